@@ -2,6 +2,7 @@ import logging.config
 import os
 from multiprocessing import Pipe, Process
 
+from src.backup_scheduler.async_download_engine import AsyncDownloadEngine
 from src.backup_scheduler.backup_scheduler import BackupScheduler
 from src.client_listener.client_listener import ClientListener
 from src.database.disk_database import DiskDatabase
@@ -13,6 +14,11 @@ def main() -> int:
     listen_backlog = 10
     backup_data_path = os.getenv('BACKUP_DATA_PATH')
     max_backup_processes = int(os.getenv('MAX_BACKUP_PROCESSES'))
+    download_engine = None
+    if os.getenv('BACKUP_ENGINE', 'process') == 'async':
+        download_engine = AsyncDownloadEngine(int(os.getenv('MAX_CONCURRENT_DOWNLOADS', max_backup_processes)),
+                                              int(os.getenv('HASH_WORKERS', 2)))
+        max_backup_processes = download_engine.max_concurrent_downloads
 
     backup_scheduler_recv, client_listener_send = Pipe(False)
     client_listener_recv, backup_scheduler_send = Pipe(False)
@@ -20,7 +26,8 @@ def main() -> int:
     database = DiskDatabase(backup_data_path + "/database")
     backup_scheduler = BackupScheduler(backup_data_path + "/data",
                                        database, backup_scheduler_recv,
-                                       backup_scheduler_send, max_backup_processes)
+                                       backup_scheduler_send, max_backup_processes,
+                                       download_engine)
     client_listener = ClientListener(port, listen_backlog,
                                      client_listener_send, client_listener_recv)
     p = Process(target=client_listener)
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import logging
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process, Queue
+from typing import NoReturn, Set
+
+from src.backup_scheduler.async_node_handler import AsyncNodeHandler
+
+DEFAULT_HASH_WORKERS = 2
+
+
+class AsyncDownloadJob:
+    """
+    A backup running in an AsyncDownloadEngine, it can be used as the process of a RunningTask
+    """
+
+    def __init__(self, engine: 'AsyncDownloadEngine', job_id: int):
+        self.engine = engine
+        self.job_id = job_id
+
+    def is_alive(self) -> bool:
+        return self.engine.is_running(self.job_id)
+
+    def terminate(self):
+        self.engine.terminate()
+
+
+class AsyncDownloadEngine:
+    """
+    Runs the backups as AsyncNodeHandler coroutines in the event loop of one process
+
+    Backups are submitted with submit and run concurrently, up to max_concurrent_downloads.
+    The downloaded files are verified in a pool of hash_workers processes. The engine process
+    reports every finished job through a queue, the backup results are left in the same files
+    NodeHandlerProcess leaves them.
+    """
+    logger = logging.getLogger(__module__)
+
+    def __init__(self, max_concurrent_downloads: int, hash_workers: int = DEFAULT_HASH_WORKERS):
+        """
+        Creates the engine, it is started with start
+
+        :param max_concurrent_downloads: the maximum number of backups running at the same time
+        :param hash_workers: the number of processes verifying downloaded files
+        """
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.hash_workers = hash_workers
+        self.job_queue = Queue()
+        self.finished_queue = Queue()
+        self.job_ids = itertools.count()
+        self.running_jobs: Set[int] = set()
+        self.process = None
+
+    def start(self):
+        """
+        Starts the engine process
+        """
+        self.process = Process(target=self._run, args=(self.job_queue, self.finished_queue,
+                                                       self.max_concurrent_downloads, self.hash_workers))
+        self.process.start()
+
+    def submit(self, node_handler: AsyncNodeHandler) -> AsyncDownloadJob:
+        """
+        Submits a backup to the engine
+
+        :param node_handler: the handler of the backup
+        :return: the job of the backup
+        """
+        job_id = next(self.job_ids)
+        self.running_jobs.add(job_id)
+        self.job_queue.put((job_id, node_handler))
+        return AsyncDownloadJob(self, job_id)
+
+    def is_running(self, job_id: int) -> bool:
+        """
+        Checks whether a job is still running, all the jobs end if the engine process dies
+
+        :param job_id: the id of the job
+        :return: a boolean
+        """
+        try:
+            while True:
+                self.running_jobs.discard(self.finished_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not self.process.is_alive():
+            self.running_jobs.clear()
+        return job_id in self.running_jobs
+
+    def stop(self):
+        """
+        Stops the engine after the submitted jobs finish
+        """
+        self.job_queue.put(None)
+        self.process.join()
+
+    def terminate(self):
+        if self.process and self.process.is_alive():
+            self.process.terminate()
+
+    @staticmethod
+    def _run(job_queue: Queue, finished_queue: Queue, max_concurrent_downloads: int,
+             hash_workers: int) -> NoReturn:
+        asyncio.run(AsyncDownloadEngine._serve(job_queue, finished_queue, max_concurrent_downloads, hash_workers))
+
+    @staticmethod
+    async def _serve(job_queue: Queue, finished_queue: Queue, max_concurrent_downloads: int,
+                     hash_workers: int):
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(max_concurrent_downloads)
+        tasks = set()
+
+        async def run_job(job_id: int, node_handler: AsyncNodeHandler):
+            async with semaphore:
+                try:
+                    await node_handler(hash_executor)
+                except Exception:
+                    AsyncDownloadEngine.logger.exception("Error in async node handler")
+            finished_queue.put(job_id)
+
+        with ProcessPoolExecutor(max_workers=hash_workers) as hash_executor:
+            while True:
+                job = await loop.run_in_executor(None, job_queue.get)
+                if job is None:
+                    break
+                task = loop.create_task(run_job(*job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
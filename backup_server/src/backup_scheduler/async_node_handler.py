@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import Executor
+from typing import Optional
+
+from backup_utils.async_socket_transferer import AsyncSocketTransferer
+from backup_utils.backup_file import BackupFile, DEFAULT_COMPRESSION
+from backup_utils.blocking_socket_transferer import LATEST_PROTOCOL
+from src.backup_scheduler.node_handler_process import CORRECT_FILE_FORMAT, WIP_FILE_FORMAT, SAME_FILE_FORMAT, \
+    RESULT_FILE_FORMAT, TRANSFER_TIMEOUT_SECONDS
+
+
+def hash_backup_file(backup_path: str) -> str:
+    """
+    Hashes a backup file, to be run in a process pool
+
+    :param backup_path: the path of the backup file
+    :return: the hash of the backup file
+    """
+    return BackupFile(backup_path).get_hash()
+
+
+class AsyncNodeHandler:
+    """
+    asyncio version of NodeHandlerProcess, many of them run concurrently in one event loop
+
+    It follows the same protocol and leaves the same files as NodeHandlerProcess. The
+    downloaded file is verified in an executor, so hashing does not block the event loop.
+    Transfers are not resumable.
+    """
+    logger = logging.getLogger(__module__)
+
+    def __init__(self, node_address: str, node_port: int,
+                 node_path: str, write_file_path: str,
+                 previous_checksum: str, compression: str = DEFAULT_COMPRESSION,
+                 incremental: bool = False):
+        """
+        Creates an async node handler
+
+        :param node_address: the address of the node
+        :param node_port: the port of the node
+        :param node_path: the path on the node to backup
+        :param write_file_path: the local path where to save the backup
+        :param previous_checksum: the previous backup checksum
+        :param compression: the compression the sidecar should use for the backup file
+        :param incremental: whether to ask for an incremental backup
+        """
+        self.node_address = node_address
+        self.node_port = node_port
+        self.node_path = node_path
+        self.write_file_path = write_file_path
+        self.previous_checksum = previous_checksum
+        self.compression = compression
+        self.incremental = incremental
+
+    async def __call__(self, hash_executor: Optional[Executor] = None):
+        """
+        Makes the backup, see NodeHandlerProcess.__call__
+
+        :param hash_executor: the executor where to verify the downloaded file, None for the default one
+        """
+        AsyncNodeHandler.logger.debug("Starting node handler for node %s:%d and path %s" %
+                                      (self.node_address, self.node_port, self.node_path))
+        try:
+            reader, writer = await asyncio.open_connection(self.node_address, self.node_port)
+        except OSError as e:
+            AsyncNodeHandler.logger.error("Error connecting to node %s:%d: %s" % (self.node_address, self.node_port, e))
+            return
+        socket_transferer = AsyncSocketTransferer(reader, writer)
+        try:
+            await self._backup(socket_transferer, hash_executor)
+        except Exception as e:
+            AsyncNodeHandler.logger.exception("Error while backing up node %s:%d and path %s: %s" %
+                                              (self.node_address, self.node_port, self.node_path, e))
+        finally:
+            await socket_transferer.close()
+        AsyncNodeHandler.logger.info("Terminating handler for node %s:%d and path %s" %
+                                     (self.node_address, self.node_port, self.node_path))
+
+    async def _backup(self, socket_transferer: AsyncSocketTransferer, hash_executor: Optional[Executor]):
+        await socket_transferer.send_plain_text(json.dumps({"checksum": self.previous_checksum,
+                                                            "path": self.node_path,
+                                                            "compression": self.compression,
+                                                            "incremental": self.incremental,
+                                                            "protocol": LATEST_PROTOCOL}))
+        msg = await socket_transferer.receive_plain_text()
+        if msg == "SAME":
+            AsyncNodeHandler.logger.debug("The backup was the same")
+            open(SAME_FILE_FORMAT % self.write_file_path, 'w').close()
+            return
+        if msg == "ABORT":
+            AsyncNodeHandler.logger.error("Abort order sent from sidecar")
+            return
+        open(WIP_FILE_FORMAT % self.write_file_path, 'w').close()
+        socket_transferer.timeout = TRANSFER_TIMEOUT_SECONDS
+        with open(self.write_file_path, 'ab') as data_file:
+            await socket_transferer.receive_file_data(data_file)
+        AsyncNodeHandler.logger.debug("File data received")
+        checksum = await socket_transferer.receive_plain_text()
+        incremental_result = await socket_transferer.receive_plain_text() if self.incremental else None
+        local_checksum = await asyncio.get_event_loop().run_in_executor(hash_executor, hash_backup_file,
+                                                                        self.write_file_path)
+        if local_checksum != checksum:
+            AsyncNodeHandler.logger.error("Error verifying checksum. Local: %s vs Server: %s" %
+                                          (local_checksum, checksum))
+            return
+        result = json.loads(incremental_result) if incremental_result else {"checksum": checksum}
+        if result["checksum"] == self.previous_checksum:
+            AsyncNodeHandler.logger.debug("The streamed backup was the same")
+            os.remove(self.write_file_path)
+            open(SAME_FILE_FORMAT % self.write_file_path, 'w').close()
+            os.remove(WIP_FILE_FORMAT % self.write_file_path)
+            return
+        with open(RESULT_FILE_FORMAT % self.write_file_path, 'w') as result_file:
+            json.dump(result, result_file)
+        open(CORRECT_FILE_FORMAT % self.write_file_path, 'w').close()
+        os.remove(WIP_FILE_FORMAT % self.write_file_path)
@@ -1,15 +1,18 @@
 import base64
+import json
 import logging
 import os
 from collections import deque
 from datetime import datetime, timezone
 from multiprocessing import Pipe, Process
-from typing import NoReturn, NamedTuple, Optional
+from typing import NoReturn, NamedTuple, Optional, Dict, Union
 
-from backup_utils.backup_file import BackupFile
+from backup_utils.backup_file import BackupFile, DEFAULT_COMPRESSION
+from src.backup_scheduler.async_download_engine import AsyncDownloadEngine, AsyncDownloadJob
+from src.backup_scheduler.async_node_handler import AsyncNodeHandler
 from src.backup_scheduler.client_request_handler import ClientRequestHandler
-from src.backup_scheduler.node_handler_process import NodeHandlerProcess, CORRECT_FILE_FORMAT, WIP_FILE_FORMAT, \
-    SAME_FILE_FORMAT
+from src.backup_scheduler.node_handler_process import NodeHandlerProcess, NodeBatchHandlerProcess, \
+    CORRECT_FILE_FORMAT, WIP_FILE_FORMAT, SAME_FILE_FORMAT, RESULT_FILE_FORMAT
 from src.database.database import Database
 from src.database.entities.finished_task import FinishedTask
 
@@ -17,6 +20,7 @@ SECONDS_TO_MINUTES = 60
 WRITE_FILE_PATH_TEMPLATE = '%s/backup_%d_%s_%s'
 SECONDS_TO_WAIT_CLIENT = 10
 MAX_FINISHED_TASKS_TO_STORE = 10
+MAX_PATHS_PER_BATCH = 16
 
 
 class ScheduledTask(NamedTuple):
@@ -27,6 +31,8 @@ class ScheduledTask(NamedTuple):
     frequency: int
     last_checksum: str
     last_backup: Optional[datetime] = None
+    compression: str = DEFAULT_COMPRESSION
+    incremental: bool = False
 
     def should_run(self) -> bool:
         """
@@ -40,7 +46,8 @@ class ScheduledTask(NamedTuple):
 
 class RunningTask(NamedTuple):
     write_file_path: str
-    process: Process
+    process: Union[Process, AsyncDownloadJob]
+    compression: str = DEFAULT_COMPRESSION
 
     def is_running(self):
         return self.process.is_alive()
@@ -59,8 +66,24 @@ class RunningTask(NamedTuple):
                 os.remove(self.write_file_path)
             if os.path.isfile(WIP_FILE_FORMAT % self.write_file_path):
                 os.remove(WIP_FILE_FORMAT % self.write_file_path)
+            if os.path.isfile(RESULT_FILE_FORMAT % self.write_file_path):
+                os.remove(RESULT_FILE_FORMAT % self.write_file_path)
             return False
 
+    def backup_result(self) -> Dict[str, str]:
+        """
+        Gets the result the node handler saved for the backup and deletes its file
+
+        :return: a dict with the checksum of the data and, if the backup is incremental,
+        the checksum of the base backup. Empty if the node handler did not save a result
+        """
+        if not os.path.isfile(RESULT_FILE_FORMAT % self.write_file_path):
+            return {}
+        with open(RESULT_FILE_FORMAT % self.write_file_path, 'r') as result_file:
+            result = json.load(result_file)
+        os.remove(RESULT_FILE_FORMAT % self.write_file_path)
+        return result
+
     def backup_is_same(self) -> bool:
         """
         Checks if the backup is the same as the previous one
@@ -93,7 +116,10 @@ class BackupScheduler:
                                                    node_port=node_port, node_path=path,
                                                    frequency=frequency,
                                                    last_backup=last_backup,
-                                                   last_checksum=last_checksum))
+                                                   last_checksum=last_checksum,
+                                                   compression=self.database.get_task_compression(node_name,
+                                                                                                  path),
+                                                   incremental=self.database.is_task_incremental(node_name, path)))
 
     def _clean_backup_path(self) -> NoReturn:
         """
@@ -104,7 +130,8 @@ class BackupScheduler:
         for node_name in node_names:
             for node_path, _ in self.database.get_tasks_for_node(node_name):
                 for ft in self.database.get_node_finished_tasks(node_name, node_path)[:MAX_FINISHED_TASKS_TO_STORE]:
-                    valid_file_prefixes.update([ft.result_path])
+                    valid_file_prefixes.update([chain_ft.result_path for chain_ft in
+                                                self.database.get_backup_chain(node_name, node_path, ft)])
         valid_file_prefixes.update([task.write_file_path for task in self.running_tasks.values()])
         files_in_directory = os.listdir(self.backup_path)
         files_to_delete = [f for f in files_in_directory if
@@ -114,7 +141,8 @@ class BackupScheduler:
 
     def __init__(self, backup_path: str, database: Database,
                  pipe_request_read: Pipe, pipe_request_answer: Pipe,
-                 max_processes_for_tasks: int):
+                 max_processes_for_tasks: int,
+                 download_engine: Optional[AsyncDownloadEngine] = None):
         """
         Initializes the backup scheduler
 
@@ -122,7 +150,9 @@ class BackupScheduler:
         :param database: the database to use
         :param pipe_request_read: the read end pipe to handle controller commands
         :param pipe_request_answer: the read end pipe to handle controller commands
-        :param max_processes_for_tasks: the maximum number of processes for tasks
+        :param max_processes_for_tasks: the maximum number of processes for tasks, or of concurrent
+        backups if there is a download engine
+        :param download_engine: if set, the backups run in this engine instead of one process each
         """
         self.backup_path = backup_path
         self.database = database
@@ -134,6 +164,7 @@ class BackupScheduler:
         self.command_parser = ClientRequestHandler(database)
         self.task_queue = deque()
         self.max_processes = max_processes_for_tasks
+        self.download_engine = download_engine
 
     @staticmethod
     def safe_base64(text: str) -> str:
@@ -160,8 +191,23 @@ class BackupScheduler:
         except Exception as e:
             BackupScheduler.logger.exception("Error handling client request")
             self.pipe_request_answer.send(("Error %s:" % str(e), data))
+            return
         self.pipe_request_answer.send(("OK", data))
 
+    def _find_result_path(self, node_name: str, node_path: str, checksum: str) -> Optional[str]:
+        """
+        Finds the backup file of the most recent finished task with a checksum
+
+        :param node_name: the node name
+        :param node_path: the node path
+        :param checksum: the checksum
+        :return: the result path or None if there is no finished task with that checksum
+        """
+        for ft in self.database.get_node_finished_tasks(node_name, node_path):
+            if ft.checksum == checksum:
+                return ft.result_path
+        return None
+
     def _dispatch_running_tasks(self):
         """
         Handles running tasks
@@ -170,20 +216,29 @@ class BackupScheduler:
         for node_data, task in self.running_tasks.items():
             if not task.is_running():
                 if task.backup_is_correct():
+                    result = task.backup_result()
+                    base_result_path = ""
+                    if result.get('base_checksum'):
+                        base_result_path = self._find_result_path(node_data[0], node_data[1],
+                                                                  result['base_checksum'])
+                        if not base_result_path:
+                            BackupScheduler.logger.error("Base backup of incremental backup for node %s and "
+                                                         "path %s not found" % node_data)
+                            os.remove(task.write_file_path)
+                            continue
                     ft = FinishedTask(result_path=task.write_file_path,
                                       kb_size=os.path.getsize(task.write_file_path) / 1024,
                                       timestamp=datetime.now(),
-                                      checksum=BackupFile(task.write_file_path).get_hash())
+                                      checksum=result.get('checksum') or BackupFile(task.write_file_path).get_hash(),
+                                      compression=task.compression,
+                                      base_result_path=base_result_path)
                     self.database.register_finished_task(node_data[0], node_data[1], ft)
                     BackupScheduler.logger.info("Backup for node %s and path %s finished succesfully" % node_data)
                     self._reload_schedule()
                     self._clean_backup_path()
                 elif task.backup_is_same():
                     ft = self.database.get_node_finished_tasks(node_data[0], node_data[1])[0]
-                    ft = FinishedTask(result_path=ft.result_path,
-                                      kb_size=ft.kb_size,
-                                      timestamp=datetime.now(),
-                                      checksum=ft.checksum)
+                    ft = ft._replace(timestamp=datetime.now())
                     self.database.register_finished_task(node_data[0], node_data[1], ft)
                     BackupScheduler.logger.info("Backup for node %s and path %s finished succesfully" % node_data)
                     self._reload_schedule()
@@ -197,31 +252,59 @@ class BackupScheduler:
     def _run_new_tasks(self):
         """
         Handles the schedule to run new tasks
+
+        The queued tasks of the same node, up to MAX_PATHS_PER_BATCH, are launched together
+        in one process that backups their paths over the same connection with the sidecar.
+        If there is a download engine every task is submitted to it instead.
         """
         for sched_task in self.schedule:
             if (sched_task.node_name, sched_task.node_path) in self.running_tasks:
                 continue
-            if sched_task.should_run() and (
-                    sched_task.node_name, sched_task.node_path, sched_task.last_checksum) not in self.task_queue:
-                self.task_queue.appendleft((sched_task.node_name, sched_task.node_path, sched_task.last_checksum))
-            number_of_running_tasks = len(self.running_tasks)
-            for queued_task in range(min(self.max_processes - number_of_running_tasks, len(self.task_queue))):
-                node_name, node_path, last_checksum = self.task_queue.pop()
-                node_address, node_port = self.database.get_node_address(node_name)
+            queued_task = (sched_task.node_name, sched_task.node_path,
+                           sched_task.last_checksum, sched_task.compression, sched_task.incremental)
+            if sched_task.should_run() and queued_task not in self.task_queue:
+                self.task_queue.appendleft(queued_task)
+        number_of_running_processes = len({task.process for task in self.running_tasks.values()})
+        max_paths_per_batch = 1 if self.download_engine else MAX_PATHS_PER_BATCH
+        while self.task_queue and number_of_running_processes < self.max_processes:
+            batch = [self.task_queue.pop()]
+            for queued_task in reversed(list(self.task_queue)):
+                if len(batch) == max_paths_per_batch:
+                    break
+                if queued_task[0] == batch[0][0]:
+                    batch.append(queued_task)
+                    self.task_queue.remove(queued_task)
+            node_address, node_port = self.database.get_node_address(batch[0][0])
+            handler_kwargs = {} if self.download_engine else {"streams": self.database.get_node_streams(batch[0][0])}
+            node_handlers = []
+            for node_name, node_path, last_checksum, compression, incremental in batch:
                 write_file_path = WRITE_FILE_PATH_TEMPLATE % (self.backup_path,
                                                               datetime.now().replace(tzinfo=timezone.utc).timestamp(),
                                                               node_name,
                                                               self.safe_base64(node_path))
-                node_handler = NodeHandlerProcess(node_address=node_address,
-                                                  node_path=node_path,
-                                                  node_port=node_port,
-                                                  write_file_path=write_file_path,
-                                                  previous_checksum=last_checksum)
-                p = Process(target=node_handler)
+                node_handler_class = AsyncNodeHandler if self.download_engine else NodeHandlerProcess
+                node_handlers.append(node_handler_class(node_address=node_address,
+                                                        node_path=node_path,
+                                                        node_port=node_port,
+                                                        write_file_path=write_file_path,
+                                                        previous_checksum=last_checksum,
+                                                        compression=compression,
+                                                        incremental=incremental,
+                                                        **handler_kwargs))
+            if self.download_engine:
+                p = self.download_engine.submit(node_handlers[0])
+            else:
+                if len(node_handlers) == 1:
+                    p = Process(target=node_handlers[0])
+                else:
+                    p = Process(target=NodeBatchHandlerProcess(node_handlers))
                 p.start()
+            number_of_running_processes += 1
+            for (node_name, node_path, _, compression, _), node_handler in zip(batch, node_handlers):
                 BackupScheduler.logger.debug("Backup order for node %s and path %s launched" %
                                              (node_name, node_path))
-                self.running_tasks[(node_name, node_path)] = RunningTask(write_file_path, p)
+                self.running_tasks[(node_name, node_path)] = RunningTask(node_handler.write_file_path, p,
+                                                                         compression)
 
     def __call__(self) -> NoReturn:
         """
@@ -241,6 +324,8 @@ class BackupScheduler:
             * Kill all other processes then dies
         """
         try:
+            if self.download_engine:
+                self.download_engine.start()
             self._reload_schedule()
             self._clean_backup_path()
             while True:
@@ -253,4 +338,4 @@ class BackupScheduler:
             self.pipe_request_answer.close()
             for t in self.running_tasks.values():
                 if t.process.is_alive():
-                    t.process.termitate()
+                    t.process.terminate()
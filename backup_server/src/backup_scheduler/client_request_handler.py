@@ -1,5 +1,6 @@
 from typing import Any, Dict, Tuple, Optional
 
+from backup_utils.backup_file import DEFAULT_COMPRESSION, parse_compression
 from src.database.database import Database
 
 
@@ -12,30 +13,43 @@ class ClientRequestHandler:
         """
         self.database = database
 
-    def add_node(self, name: str, address: str, port: int) -> Tuple[Optional[Any], bool]:
+    def add_node(self, name: str, address: str, port: int, streams: int = 1) -> Tuple[Optional[Any], bool]:
         """
         Adds a node to the database
 
+        :raises:
+            ValueError: if streams is not positive
+
         :param name: the node name
         :param address: the node address
         :param port: the node port
+        :param streams: the parallel connections used to download big backup files of the node
         :return: no data and a boolean indicating if the tasks have changed
         """
-        self.database.register_node(name, address, port)
+        if streams < 1:
+            raise ValueError("The streams of a node must be positive")
+        self.database.register_node(name, address, port, streams)
         if self.database.get_tasks_for_node(name):
             return None, True
         return None, False
 
-    def add_task(self, name: str, path: str, frequency: int) -> Tuple[Optional[Any], bool]:
+    def add_task(self, name: str, path: str, frequency: int,
+                 compression: str = DEFAULT_COMPRESSION, incremental: bool = False) -> Tuple[Optional[Any], bool]:
         """
         Adds a task to the node
 
+        :raises:
+            ValueError: if the compression is not valid
+
         :param name: the name of the node
         :param path: the path inside the node
         :param frequency: the backup frequency in minutes
+        :param compression: the compression codec and level, for example 'none', 'gz:1', 'bz2' or 'xz'
+        :param incremental: whether to backup only what changed since the previous backup
         :return: no data and a boolean indicating if the tasks have changed, always true
         """
-        self.database.add_scheduled_task(name, path, frequency)
+        parse_compression(compression)
+        self.database.add_scheduled_task(name, path, frequency, compression, incremental)
         return None, True
 
     def query_backups(self, name: str, path: str) -> Tuple[Optional[Any], bool]:
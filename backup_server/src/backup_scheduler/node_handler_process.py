@@ -2,14 +2,50 @@ import json
 import logging
 import os
 import socket
-from typing import NoReturn
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from typing import NoReturn, Optional, List, Tuple
 
-from backup_utils.backup_file import BackupFile
-from backup_utils.blocking_socket_transferer import BlockingSocketTransferer
+from backup_utils.backup_file import BackupFile, DEFAULT_COMPRESSION, StreamingHasher
+from backup_utils.blocking_socket_transferer import BlockingSocketTransferer, LATEST_PROTOCOL, SocketClosed, \
+    ProtocolError, DEFAULT_FILE_CHUNK_SIZE
 
 CORRECT_FILE_FORMAT = '%s.CORRECT'
 WIP_FILE_FORMAT = '%s.WIP'
 SAME_FILE_FORMAT = '%s.SAME'
+RESULT_FILE_FORMAT = '%s.RESULT'
+RESUMABLE_DIFF_PREFIX = "DIFF:"
+RANGES_PREFIX = "RANGES:"
+MIN_RANGE_SIZE = 8 * DEFAULT_FILE_CHUNK_SIZE
+MAX_RESUME_ATTEMPTS = 5
+RESUME_WAIT_SECONDS = 5
+TRANSFER_TIMEOUT_SECONDS = 60
+NEXT_MESSAGE = "NEXT"
+
+
+class OffsetFileWriter:
+    """
+    Writes sequentially to a file from an offset without moving its file position,
+    so several threads can write different ranges of the same file
+    """
+
+    def __init__(self, file_descriptor: int, offset: int):
+        """
+        Creates the writer
+
+        :param file_descriptor: the descriptor of the file, not opened for appending
+        :param offset: the position where to write the first byte
+        """
+        self.file_descriptor = file_descriptor
+        self.offset = offset
+
+    def write(self, data) -> int:
+        data = memoryview(data)
+        written = 0
+        while written < len(data):
+            written += os.pwrite(self.file_descriptor, data[written:], self.offset + written)
+        self.offset += written
+        return written
 
 
 class NodeHandlerProcess:
@@ -20,7 +56,9 @@ class NodeHandlerProcess:
 
     def __init__(self, node_address: str, node_port: int,
                  node_path: str, write_file_path: str,
-                 previous_checksum: str):
+                 previous_checksum: str, compression: str = DEFAULT_COMPRESSION,
+                 incremental: bool = False, resume_attempts: int = MAX_RESUME_ATTEMPTS,
+                 resume_wait: float = RESUME_WAIT_SECONDS, streams: int = 1):
         """
         Creates a node handler process
 
@@ -29,72 +67,342 @@ class NodeHandlerProcess:
         :param node_path: the path on the node to backup
         :param write_file_path: the local path where to save the backup
         :param previous_checksum: the previous backup checksum
+        :param compression: the compression the sidecar should use for the backup file
+        :param incremental: whether to ask for an incremental backup
+        :param resume_attempts: the times an interrupted download is resumed before giving up
+        :param resume_wait: the seconds to wait before resuming a download
+        :param streams: the parallel connections used to download big backup files, they need resumable transfers
         """
         self.node_address = node_address
         self.node_port = node_port
         self.node_path = node_path
         self.write_file_path = write_file_path
         self.previous_checksum = previous_checksum
+        self.compression = compression
+        self.incremental = incremental
+        self.resume_attempts = resume_attempts
+        self.resume_wait = resume_wait
+        self.streams = streams
 
-    def __call__(self) -> NoReturn:
+    def _connect(self) -> BlockingSocketTransferer:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((self.node_address, self.node_port))
+        return BlockingSocketTransferer(sock)
+
+    def _request_backup(self, socket_transferer: BlockingSocketTransferer, keep_alive: bool) -> str:
+        socket_transferer.send_plain_text(json.dumps({"checksum": self.previous_checksum,
+                                                      "path": self.node_path,
+                                                      "compression": self.compression,
+                                                      "incremental": self.incremental,
+                                                      "protocol": LATEST_PROTOCOL,
+                                                      "resumable": self.resume_attempts > 0,
+                                                      "streams": self.streams,
+                                                      "keep_alive": keep_alive}))
+        return socket_transferer.receive_plain_text()
+
+    def _request_transfer_data(self, transfer_id: str, request: dict) -> BlockingSocketTransferer:
+        """
+        Connects to the sidecar asking for data of a stored transfer
+
+        :raises:
+            ProtocolError: if the sidecar does not have the transfer anymore
+
+        :param transfer_id: the id of the transfer
+        :param request: the request, the protocol is added to it
+        :return: the transferer, ready to receive the data
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(TRANSFER_TIMEOUT_SECONDS)
+        sock.connect((self.node_address, self.node_port))
+        socket_transferer = BlockingSocketTransferer(sock)
+        socket_transferer.send_plain_text(json.dumps(dict(request, protocol=LATEST_PROTOCOL)))
+        msg = socket_transferer.receive_plain_text()
+        if msg != RESUMABLE_DIFF_PREFIX + transfer_id:
+            self._close_quietly(socket_transferer)
+            raise ProtocolError("The sidecar could not send data of the transfer %s: %s" % (transfer_id, msg))
+        return socket_transferer
+
+    def _resume_transfer(self, transfer_id: str, offset: int, keep_alive: bool) -> BlockingSocketTransferer:
+        """
+        Reconnects to the sidecar asking for the rest of a transfer
+
+        :raises:
+            ProtocolError: if the sidecar does not have the transfer anymore
+
+        :param transfer_id: the id of the transfer
+        :param offset: the bytes of the backup file already received
+        :param keep_alive: whether to ask the sidecar to keep the connection for another request
+        :return: the transferer, ready to receive the rest of the file
+        """
+        return self._request_transfer_data(transfer_id, {"resume": transfer_id, "offset": offset,
+                                                         "keep_alive": keep_alive})
+
+    def _download_range(self, file_descriptor: int, transfer_id: str, offset: int, length: int) -> NoReturn:
+        """
+        Downloads a range of the backup file of a transfer over its own connection, resuming
+        it up to self.resume_attempts times if the connection is lost
+
+        :param file_descriptor: the descriptor of the backup file
+        :param transfer_id: the id of the transfer
+        :param offset: the position of the first byte of the range
+        :param length: the size of the range
+        """
+        writer = OffsetFileWriter(file_descriptor, offset)
+        attempts = 0
+        while True:
+            socket_transferer = None
+            try:
+                request = {"range": transfer_id, "offset": writer.offset, "length": offset + length - writer.offset}
+                socket_transferer = self._request_transfer_data(transfer_id, request)
+                socket_transferer.receive_file_data(writer)
+                return
+            except (OSError, SocketClosed) as e:
+                if attempts >= self.resume_attempts:
+                    raise
+                attempts += 1
+                NodeHandlerProcess.logger.warning("Connection lost downloading bytes %d to %d of transfer %s: %s, "
+                                                  "resuming it (attempt %d)" % (offset, offset + length, transfer_id,
+                                                                                e, attempts))
+                sleep(self.resume_wait)
+            finally:
+                self._close_quietly(socket_transferer)
+
+    def _download_ranges(self, transfer_id: str, file_size: int) -> NoReturn:
         """
-        Code for running the handler in a new process
+        Downloads the backup file of a transfer over up to self.streams parallel connections,
+        every one writing its range of the preallocated file
+
+        :param transfer_id: the id of the transfer
+        :param file_size: the size of the backup file
+        """
+        streams = max(min(self.streams, file_size // MIN_RANGE_SIZE), 1)
+        range_size = max(-(-file_size // streams), 1)
+        with open(self.write_file_path, 'wb') as data_file:
+            try:
+                os.posix_fallocate(data_file.fileno(), 0, file_size)
+            except (AttributeError, OSError):
+                os.ftruncate(data_file.fileno(), file_size)
+            with ThreadPoolExecutor(max_workers=streams) as executor:
+                downloads = [executor.submit(self._download_range, data_file.fileno(), transfer_id,
+                                             offset, min(range_size, file_size - offset))
+                             for offset in range(0, file_size, range_size)]
+                for download in downloads:
+                    download.result()
+        NodeHandlerProcess.logger.debug("Backup file of transfer %s downloaded over %d connections" %
+                                        (transfer_id, streams))
+
+    def _receive_trailer(self, socket_transferer: BlockingSocketTransferer) -> Tuple[str, Optional[str]]:
+        """
+        Receives the messages after a backup file
+
+        :return: a tuple (checksum of the backup file, checksums of the data if it is incremental else None)
+        """
+        checksum = socket_transferer.receive_plain_text()
+        incremental_result = socket_transferer.receive_plain_text() if self.incremental else None
+        return checksum, incremental_result
+
+    def _download_file(self, socket_transferer: BlockingSocketTransferer, transfer_id: Optional[str],
+                       keep_alive: bool) -> Tuple[BlockingSocketTransferer, str, Optional[str], str]:
+        """
+        Downloads the backup file sent after DIFF, calculating its checksum while the bytes arrive
+
+        If the transfer is resumable and the connection is lost, it reconnects and asks
+        for the rest of the file, up to self.resume_attempts times
+
+        :param socket_transferer: the transferer that received the DIFF
+        :param transfer_id: the id of the transfer if it is resumable else None
+        :param keep_alive: whether to ask the sidecar to keep the connection for another request
+        :return: a tuple (transferer, checksum sent by the sidecar, incremental result, local checksum)
+        """
+        attempts = 0
+        try:
+            with open(self.write_file_path, 'ab') as data_file:
+                hasher = StreamingHasher(data_file)
+                while True:
+                    try:
+                        if socket_transferer is None:
+                            data_file.flush()
+                            socket_transferer = self._resume_transfer(transfer_id, data_file.tell(), keep_alive)
+                        socket_transferer.receive_file_data(hasher)
+                        NodeHandlerProcess.logger.debug("File data received")
+                        checksum, incremental_result = self._receive_trailer(socket_transferer)
+                        if transfer_id:
+                            socket_transferer.send_ok()
+                        break
+                    except (OSError, SocketClosed) as e:
+                        if not transfer_id or attempts >= self.resume_attempts:
+                            raise
+                        attempts += 1
+                        NodeHandlerProcess.logger.warning("Connection lost downloading transfer %s: %s, "
+                                                          "resuming it (attempt %d)" % (transfer_id, e, attempts))
+                        self._close_quietly(socket_transferer)
+                        socket_transferer = None
+                        sleep(self.resume_wait)
+        except Exception:
+            self._close_quietly(socket_transferer)
+            raise
+        return socket_transferer, checksum, incremental_result, hasher.hexdigest()
+
+    @staticmethod
+    def _close_quietly(socket_transferer: Optional[BlockingSocketTransferer]):
+        if socket_transferer is None:
+            return
+        try:
+            socket_transferer.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _reusable_connection(socket_transferer: BlockingSocketTransferer,
+                             keep_alive: bool) -> Optional[BlockingSocketTransferer]:
+        """
+        Gets the connection back if the sidecar kept it open for another request
+
+        :param socket_transferer: the transferer of the finished request
+        :param keep_alive: whether the finished request asked to keep the connection
+        :return: the transferer or None if the connection is closed
+        """
+        if keep_alive:
+            try:
+                socket_transferer.socket.settimeout(None)
+                if socket_transferer.receive_plain_text() == NEXT_MESSAGE:
+                    return socket_transferer
+            except (OSError, SocketClosed):
+                pass
+        NodeHandlerProcess._close_quietly(socket_transferer)
+        return None
+
+    def __call__(self, socket_transferer: Optional[BlockingSocketTransferer] = None,
+                 keep_alive: bool = False) -> Optional[BlockingSocketTransferer]:
+        """
+        Code for running the handler in a new process, or in a NodeBatchHandlerProcess
 
         The process works this way:
-            1. Connects to node sidecar asking for node_path compressed
+            1. Connects to node sidecar asking for node_path compressed, offering the newest protocol
+            version, old sidecars ignore it and answer with the protocol v1
             2. If the backup is the same as previous checksum, writes a .SAME file
-            3. Downloads the file saving it in write file path
+            If the sidecar supports it the download is resumable, if the connection is lost it reconnects
+            and asks for the rest of the file, up to self.resume_attempts times
+            3. Downloads the file saving it in write file path, the sidecar may stream it with its checksums
+            as a trailer, then if the data checksum is the previous one it is deleted and a .SAME file is written
+            If self.streams is greater than 1 and the sidecar supports it, a big file is downloaded by ranges
+            over parallel connections into a preallocated file, and its checksum is calculated at the end
                 3.1. At start it writes an empty file named self.write_file_path but ending with .WIP
-                3.2. Starts saving the backup in a file located in self.write_file_path
-                3.3. When the backup is saved saves an empty file named self.write_file_path but ending with .CORRECT
-                3.4. Deletes the .WIP file
+                3.2. Starts saving the backup in a file located in self.write_file_path, calculating
+                its checksum while the bytes arrive
+                3.3. Saves the checksum of the data, and of the base backup if it is incremental,
+                in a file named self.write_file_path but ending with .RESULT
+                3.4. When the backup is saved saves an empty file named self.write_file_path but ending with .CORRECT
+                3.5. Deletes the .WIP file
             4. Ｓｅｐｐｕｋｕ
+
+        :param socket_transferer: an open connection to the sidecar to reuse, if None it connects
+        :param keep_alive: whether to ask the sidecar to keep the connection for another request,
+        sidecars that support it send NEXT_MESSAGE when they are ready for it
+        :return: the connection if the sidecar kept it open, else None
         """
         NodeHandlerProcess.logger.debug("Starting node handler for node %s:%d and path %s" %
                                         (self.node_address, self.node_port, self.node_path))
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock.connect((self.node_address, self.node_port))
-            socket_transferer = BlockingSocketTransferer(sock)
-            socket_transferer.send_plain_text(json.dumps({"checksum": self.previous_checksum,
-                                                          "path": self.node_path}))
+            try:
+                if socket_transferer is None:
+                    socket_transferer = self._connect()
+                msg = self._request_backup(socket_transferer, keep_alive)
+            except (OSError, SocketClosed):
+                if socket_transferer is None:
+                    raise
+                NodeHandlerProcess.logger.debug("Reused connection closed, connecting again")
+                self._close_quietly(socket_transferer)
+                socket_transferer = self._connect()
+                msg = self._request_backup(socket_transferer, keep_alive)
         except Exception as e:
-            NodeHandlerProcess.logger.exception("Error while writing socket %s: %s" % (sock, e))
+            NodeHandlerProcess.logger.exception("Error while writing socket %s: %s" % (socket_transferer, e))
             NodeHandlerProcess.logger.info("Terminating handler for node %s:%d and path %s" %
                                            (self.node_address, self.node_port, self.node_path))
-            return
-        msg = socket_transferer.receive_plain_text()
+            self._close_quietly(socket_transferer)
+            return None
         if msg == "SAME":
             NodeHandlerProcess.logger.debug("The backup was the same")
             NodeHandlerProcess.logger.info("Terminating handler for node %s:%d and path %s" %
                                            (self.node_address, self.node_port, self.node_path))
             open(SAME_FILE_FORMAT % self.write_file_path, 'w').close()
-            return
+            return self._reusable_connection(socket_transferer, keep_alive)
         if msg == "ABORT":
             NodeHandlerProcess.logger.error("Abort order sent from sidecar")
             NodeHandlerProcess.logger.info("Terminating handler for node %s:%d and path %s" %
                                            (self.node_address, self.node_port, self.node_path))
-            return
+            self._close_quietly(socket_transferer)
+            return None
         open(WIP_FILE_FORMAT % self.write_file_path, 'w').close()
-        data_file = open(self.write_file_path, 'ab')
         try:
-            socket_transferer.receive_file_data(data_file)
-            NodeHandlerProcess.logger.debug("File data received")
-            checksum = socket_transferer.receive_plain_text()
+            socket_transferer.socket.settimeout(TRANSFER_TIMEOUT_SECONDS)
+            if msg.startswith(RANGES_PREFIX):
+                transfer_id, file_size = msg[len(RANGES_PREFIX):].split(':')
+                checksum, incremental_result = self._receive_trailer(socket_transferer)
+                self._download_ranges(transfer_id, int(file_size))
+                socket_transferer.send_ok()
+                local_checksum = BackupFile(self.write_file_path).get_hash()
+            else:
+                transfer_id = msg[len(RESUMABLE_DIFF_PREFIX):] if msg.startswith(RESUMABLE_DIFF_PREFIX) else None
+                socket_transferer, checksum, incremental_result, local_checksum = \
+                    self._download_file(socket_transferer, transfer_id, keep_alive)
         except Exception as e:
-            NodeHandlerProcess.logger.exception("Error while reading socket %s: %s" % (sock, e))
+            NodeHandlerProcess.logger.exception("Error while reading socket %s: %s" % (socket_transferer, e))
             NodeHandlerProcess.logger.info("Terminating handler for node %s:%d and path %s" %
                                            (self.node_address, self.node_port, self.node_path))
-            return
-        data_file.close()
-        backup_file = BackupFile(self.write_file_path)
-        if backup_file.get_hash() == checksum:
+            self._close_quietly(socket_transferer)
+            return None
+        socket_transferer = self._reusable_connection(socket_transferer, keep_alive)
+        if local_checksum == checksum:
             NodeHandlerProcess.logger.debug("Backup checksum: %s" % checksum)
         else:
             NodeHandlerProcess.logger.error("Error verifying checksum. Local: %s vs Server: %s" %
-                                            (backup_file.get_hash(), checksum))
-            return
+                                            (local_checksum, checksum))
+            return socket_transferer
+        result = json.loads(incremental_result) if incremental_result else {"checksum": checksum}
+        if result["checksum"] == self.previous_checksum:
+            NodeHandlerProcess.logger.debug("The streamed backup was the same")
+            NodeHandlerProcess.logger.info("Terminating handler for node %s:%d and path %s" %
+                                           (self.node_address, self.node_port, self.node_path))
+            os.remove(self.write_file_path)
+            open(SAME_FILE_FORMAT % self.write_file_path, 'w').close()
+            os.remove(WIP_FILE_FORMAT % self.write_file_path)
+            return socket_transferer
+        with open(RESULT_FILE_FORMAT % self.write_file_path, 'w') as result_file:
+            json.dump(result, result_file)
         open(CORRECT_FILE_FORMAT % self.write_file_path, 'w').close()
         os.remove(WIP_FILE_FORMAT % self.write_file_path)
         NodeHandlerProcess.logger.info("Terminating handler for node %s:%d and path %s" %
                                        (self.node_address, self.node_port, self.node_path))
+        return socket_transferer
+
+
+class NodeBatchHandlerProcess:
+    """
+    Handles the backups of several paths of the same node over one connection with its sidecar
+    """
+    logger = logging.getLogger(__module__)
+
+    def __init__(self, node_handlers: List[NodeHandlerProcess]):
+        """
+        Creates a node batch handler process
+
+        :param node_handlers: the handlers of the paths to backup, all for the same node
+        """
+        self.node_handlers = node_handlers
+
+    def __call__(self) -> NoReturn:
+        """
+        Code for running the handlers in sequence in a new process
+
+        Every handler asks the sidecar to keep the connection for the next one. If the
+        sidecar does not support it, or the connection is lost, the next handler connects again.
+        """
+        socket_transferer = None
+        for i, node_handler in enumerate(self.node_handlers):
+            keep_alive = i < len(self.node_handlers) - 1
+            try:
+                socket_transferer = node_handler(socket_transferer=socket_transferer, keep_alive=keep_alive)
+            except Exception:
+                NodeBatchHandlerProcess.logger.exception("Error in node handler for path %s" % node_handler.node_path)
+                socket_transferer = None
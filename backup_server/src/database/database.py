@@ -1,6 +1,7 @@
 from abc import abstractmethod
 from typing import NoReturn, List, Set, Tuple
 
+from backup_utils.backup_file import DEFAULT_COMPRESSION
 from src.database.entities.finished_task import FinishedTask
 
 
@@ -10,7 +11,7 @@ class Database:
     """
 
     @abstractmethod
-    def register_node(self, node_name: str, node_addr: str, node_port: int) -> NoReturn:
+    def register_node(self, node_name: str, node_addr: str, node_port: int, streams: int = 1) -> NoReturn:
         """
         Adds a new node to the database, if theres another one with the same name
         it overrides keeping the scheduled tasks.
@@ -18,6 +19,7 @@ class Database:
         :param node_name: the name of the node
         :param node_addr: the address of the node
         :param node_port: the port of the node for communication
+        :param streams: the parallel connections used to download big backup files of the node
         """
 
     @abstractmethod
@@ -39,6 +41,17 @@ class Database:
         :return: a tuple (address, port)
         """
 
+    @abstractmethod
+    def get_node_streams(self, node_name: str) -> int:
+        """
+        Gets the parallel connections used to download big backup files of a node
+
+        If the node does not exist it returns 1
+
+        :param node_name: the name of the node
+        :return: the number of connections
+        """
+
     @abstractmethod
     def get_tasks_for_node(self, node_name: str) -> List[Tuple[str, int]]:
         """
@@ -49,7 +62,8 @@ class Database:
         """
 
     @abstractmethod
-    def add_scheduled_task(self, node_name: str, node_path: str, frequency: int) -> NoReturn:
+    def add_scheduled_task(self, node_name: str, node_path: str, frequency: int,
+                           compression: str = DEFAULT_COMPRESSION, incremental: bool = False) -> NoReturn:
         """
         Adds a new scheduled task for the node
 
@@ -59,6 +73,32 @@ class Database:
         :param node_name: the name of the node for which the task corresponds
         :param node_path: the path inside the node
         :param frequency: the frequency in minutes for the task
+        :param compression: the compression for the backup files of the task
+        :param incremental: whether the task makes incremental backups
+        """
+
+    @abstractmethod
+    def get_task_compression(self, node_name: str, node_path: str) -> str:
+        """
+        Gets the compression of a scheduled task
+
+        If the node or the task does not exist it returns the default compression
+
+        :param node_name: the node name
+        :param node_path: the node path of the task
+        :return: the compression
+        """
+
+    @abstractmethod
+    def is_task_incremental(self, node_name: str, node_path: str) -> bool:
+        """
+        Checks whether a scheduled task makes incremental backups
+
+        If the node or the task does not exist it returns False
+
+        :param node_name: the node name
+        :param node_path: the node path of the task
+        :return: a boolean
         """
 
     @abstractmethod
@@ -84,6 +124,17 @@ class Database:
         :return: a list of finished tasks ordered from most recent to latest
         """
 
+    @abstractmethod
+    def get_backup_chain(self, node_name: str, node_path: str, task: FinishedTask) -> List[FinishedTask]:
+        """
+        Lists the finished tasks needed to rebuild a backup
+
+        :param node_name: the node name
+        :param node_path: the node path
+        :param task: the finished task to rebuild
+        :return: a list of finished tasks from the full backup to task
+        """
+
     @abstractmethod
     def delete_scheduled_task(self, node_name: str, node_path: str) -> NoReturn:
         """
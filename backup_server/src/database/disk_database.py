@@ -3,6 +3,7 @@ import os
 import pickle
 from typing import NoReturn, List, Dict, Tuple, Set
 
+from backup_utils.backup_file import DEFAULT_COMPRESSION
 from src.database.entities.finished_task import FinishedTask
 from .database import Database
 from .exceptions.unexistent_node_error import UnexistentNodeError
@@ -108,14 +109,15 @@ class DiskDatabase(Database):
                 self._commit()
 
     @staticmethod
-    def _register_node(database, node_name, node_addr, node_port):
+    def _register_node(database, node_name, node_addr, node_port, streams=1):
         if node_name in database:
-            database[node_name].update({'port': node_port, 'address': node_addr})
+            database[node_name].update({'port': node_port, 'address': node_addr, 'streams': streams})
         else:
-            database[node_name] = {'port': node_port, 'address': node_addr,
-                                   'tasks': [], 'finished_tasks': {}}
+            database[node_name] = {'port': node_port, 'address': node_addr, 'streams': streams,
+                                   'tasks': [], 'finished_tasks': {}, 'compressions': {},
+                                   'incrementals': {}}
 
-    def register_node(self, node_name: str, node_addr: str, node_port: int) -> NoReturn:
+    def register_node(self, node_name: str, node_addr: str, node_port: int, streams: int = 1) -> NoReturn:
         """
         Adds a new node to the database, if theres another one with the same name
         it overrides keeping the scheduled tasks.
@@ -123,8 +125,9 @@ class DiskDatabase(Database):
         :param node_name: the name of the node
         :param node_addr: the address of the node
         :param node_port: the port of the node for communication
+        :param streams: the parallel connections used to download big backup files of the node
         """
-        self._write_operation('_register_node', [node_name, node_addr, node_port],
+        self._write_operation('_register_node', [node_name, node_addr, node_port, streams],
                               use_log=True)
 
     def get_node_names(self) -> Set[str]:
@@ -148,6 +151,19 @@ class DiskDatabase(Database):
             raise UnexistentNodeError
         return self.database[node_name]['address'], self.database[node_name]['port']
 
+    def get_node_streams(self, node_name: str) -> int:
+        """
+        Gets the parallel connections used to download big backup files of a node
+
+        If the node does not exist it returns 1
+
+        :param node_name: the name of the node
+        :return: the number of connections
+        """
+        if node_name not in self.database:
+            return 1
+        return self.database[node_name].get('streams', 1)
+
     def get_tasks_for_node(self, node_name: str) -> List[Tuple[str, int]]:
         """
         Gets the scheduled tasks of a node
@@ -160,17 +176,21 @@ class DiskDatabase(Database):
         return self.database[node_name]['tasks']
 
     @staticmethod
-    def _add_scheduled_task(database, node_name, node_path, frequency):
+    def _add_scheduled_task(database, node_name, node_path, frequency,
+                            compression=DEFAULT_COMPRESSION, incremental=False):
         if node_name not in database:
             raise UnexistentNodeError
         database[node_name]['tasks'] = [t for t in database[node_name]['tasks'] if t[0] != node_path]
         database[node_name]['tasks'].append((node_path, frequency))
+        database[node_name].setdefault('compressions', {})[node_path] = compression
+        database[node_name].setdefault('incrementals', {})[node_path] = incremental
 
-    def add_scheduled_task(self, node_name: str, node_path: str, frequency: int) -> NoReturn:
+    def add_scheduled_task(self, node_name: str, node_path: str, frequency: int,
+                           compression: str = DEFAULT_COMPRESSION, incremental: bool = False) -> NoReturn:
         """
         Adds a new scheduled task for the node
 
-        If the path is already in a task the frequency will we overriden
+        If the path is already in a task the frequency, compression and incremental will we overriden
 
         :raises:
             UnexistentNodeError: if the node named 'node_name' is not registered
@@ -178,10 +198,41 @@ class DiskDatabase(Database):
         :param node_name: the name of the node for which the task corresponds
         :param node_path: the path inside the node
         :param frequency: the frequency in minutes for the task
+        :param compression: the compression for the backup files of the task
+        :param incremental: whether the task makes incremental backups
         """
-        self._write_operation('_add_scheduled_task', [node_name, node_path, frequency],
+        self._write_operation('_add_scheduled_task', [node_name, node_path, frequency,
+                                                      compression, incremental],
                               use_log=True)
 
+    def get_task_compression(self, node_name: str, node_path: str) -> str:
+        """
+        Gets the compression of a scheduled task
+
+        If the node or the task does not exist it returns the default compression
+
+        :param node_name: the node name
+        :param node_path: the node path of the task
+        :return: the compression
+        """
+        if node_name not in self.database:
+            return DEFAULT_COMPRESSION
+        return self.database[node_name].get('compressions', {}).get(node_path, DEFAULT_COMPRESSION)
+
+    def is_task_incremental(self, node_name: str, node_path: str) -> bool:
+        """
+        Checks whether a scheduled task makes incremental backups
+
+        If the node or the task does not exist it returns False
+
+        :param node_name: the node name
+        :param node_path: the node path of the task
+        :return: a boolean
+        """
+        if node_name not in self.database:
+            return False
+        return self.database[node_name].get('incrementals', {}).get(node_path, False)
+
     @staticmethod
     def _register_finished_task(database, node_name, node_path, task_data):
         if node_name not in database \
@@ -222,11 +273,30 @@ class DiskDatabase(Database):
         return [FinishedTask.from_dict(ft)
                 for ft in self.database[node_name]['finished_tasks'][node_path]]
 
+    def get_backup_chain(self, node_name: str, node_path: str, task: FinishedTask) -> List[FinishedTask]:
+        """
+        Lists the finished tasks needed to rebuild a backup
+
+        :param node_name: the node name
+        :param node_path: the node path
+        :param task: the finished task to rebuild
+        :return: a list of finished tasks from the full backup to task
+        """
+        finished_tasks = {}
+        for ft in reversed(self.get_node_finished_tasks(node_name, node_path)):
+            finished_tasks.setdefault(ft.result_path, ft)
+        chain = [task]
+        while chain[0].base_result_path and chain[0].base_result_path in finished_tasks:
+            chain.insert(0, finished_tasks[chain[0].base_result_path])
+        return chain
+
     @staticmethod
     def _delete_scheduled_task(database, node_name: str, node_path: str):
         if node_name not in database:
             return
         database[node_name]['tasks'] = [t for t in database[node_name]['tasks'] if t[0] != node_path]
+        database[node_name].get('compressions', {}).pop(node_path, None)
+        database[node_name].get('incrementals', {}).pop(node_path, None)
 
     def delete_scheduled_task(self, node_name: str, node_path: str) -> NoReturn:
         """
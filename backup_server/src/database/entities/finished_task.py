@@ -1,6 +1,8 @@
 from datetime import datetime
 from typing import NamedTuple, Dict
 
+from backup_utils.backup_file import DEFAULT_COMPRESSION
+
 
 class FinishedTask(NamedTuple):
     """
@@ -10,6 +12,8 @@ class FinishedTask(NamedTuple):
     kb_size: float
     timestamp: datetime
     checksum: str
+    compression: str = DEFAULT_COMPRESSION
+    base_result_path: str = ""
 
     def to_dict(self):
         data = self._asdict()
@@ -0,0 +1,121 @@
+import asyncio
+from typing import Optional, Tuple
+
+from .blocking_socket_transferer import DEFAULT_FILE_CHUNK_SIZE, OK_MESSAGE, SIZE_NUMBER_SIZE, PROTOCOL_V1, \
+    PROTOCOL_V2, V2_MAGIC, V2_HEADER, MESSAGE_TYPE_TEXT, MESSAGE_TYPE_OK, MESSAGE_TYPE_FILE_CHUNK, FLAG_LAST_CHUNK, \
+    SocketClosed, ProtocolError
+
+
+class AsyncSocketTransferer:
+    """
+    asyncio version of the receiving side of BlockingSocketTransferer
+
+    It speaks the same protocols, detecting the version of every received frame
+    and answering with the version the peer used last.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 file_chunk_size: int = DEFAULT_FILE_CHUNK_SIZE, protocol_version: int = PROTOCOL_V1):
+        """
+        Creates a transferer over a connected stream
+
+        :param reader: the reader of the connection
+        :param writer: the writer of the connection
+        :param file_chunk_size: the maximum size of the reads when receiving files
+        :param protocol_version: the protocol used to send until a frame is received
+        """
+        self.reader = reader
+        self.writer = writer
+        self.file_chunk_size = file_chunk_size
+        self.protocol_version = protocol_version
+        self.timeout: Optional[float] = None
+
+    async def _wait(self, coroutine):
+        if self.timeout is None:
+            return await coroutine
+        return await asyncio.wait_for(coroutine, self.timeout)
+
+    async def receive_exact(self, size: int) -> bytes:
+        """
+        Receives exactly size bytes
+
+        :raises:
+            SocketClosed: if the connection is closed before
+
+        :param size: the number of bytes
+        :return: the bytes received
+        """
+        try:
+            return await self._wait(self.reader.readexactly(size))
+        except asyncio.IncompleteReadError:
+            raise SocketClosed
+
+    async def _send(self, data: bytes):
+        self.writer.write(data)
+        await self._wait(self.writer.drain())
+
+    def _frame_header(self, message_type: int, size: int, flags: int = 0) -> bytes:
+        if self.protocol_version >= PROTOCOL_V2:
+            return V2_HEADER.pack(V2_MAGIC, message_type, flags, size)
+        return str(size).zfill(SIZE_NUMBER_SIZE).encode('ascii')
+
+    async def _receive_frame_header(self) -> Tuple[int, int, int]:
+        first_byte = await self.receive_exact(1)
+        if first_byte[0] == V2_MAGIC:
+            _, message_type, flags, size = V2_HEADER.unpack(first_byte +
+                                                            await self.receive_exact(V2_HEADER.size - 1))
+            self.protocol_version = PROTOCOL_V2
+            return message_type, flags, size
+        self.protocol_version = PROTOCOL_V1
+        return MESSAGE_TYPE_TEXT, 0, int(first_byte + await self.receive_exact(SIZE_NUMBER_SIZE - 1))
+
+    async def send_plain_text(self, text: str):
+        encoded_text = text.encode('utf-8')
+        await self._send(self._frame_header(MESSAGE_TYPE_TEXT, len(encoded_text)) + encoded_text)
+
+    async def receive_plain_text(self) -> str:
+        message_type, _, size = await self._receive_frame_header()
+        if message_type == MESSAGE_TYPE_OK:
+            return OK_MESSAGE
+        return (await self.receive_exact(size)).decode('utf-8')
+
+    async def send_ok(self):
+        if self.protocol_version >= PROTOCOL_V2:
+            await self._send(self._frame_header(MESSAGE_TYPE_OK, 0))
+        else:
+            await self.send_plain_text(OK_MESSAGE)
+
+    async def _receive_data(self, file, size: int):
+        while size > 0:
+            data = await self._wait(self.reader.read(min(size, self.file_chunk_size)))
+            if not data:
+                raise SocketClosed
+            file.write(data)
+            size -= len(data)
+
+    async def receive_file_data(self, file):
+        """
+        Receives a file sent with BlockingSocketTransferer.send_file or with a FileStream
+
+        :raises:
+            ProtocolError: if a stream is interrupted by another message, like an abort
+
+        :param file: a file object where to write the data
+        """
+        message_type, flags, size = await self._receive_frame_header()
+        if self.protocol_version == PROTOCOL_V1:
+            await self.send_ok()
+        await self._receive_data(file, size)
+        while message_type == MESSAGE_TYPE_FILE_CHUNK and not flags & FLAG_LAST_CHUNK:
+            message_type, flags, size = await self._receive_frame_header()
+            if message_type != MESSAGE_TYPE_FILE_CHUNK:
+                raise ProtocolError("File stream interrupted by a message of type %d" % message_type)
+            await self._receive_data(file, size)
+        await self.send_ok()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
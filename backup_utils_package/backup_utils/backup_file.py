@@ -1,46 +1,358 @@
+import bz2
+import gzip
 import hashlib
+import io
+import json
+import lzma
+import os
+import shutil
 import tarfile
+import time
+from contextlib import contextmanager
+from queue import Queue
+from threading import Thread
+from typing import Optional, Tuple, List, Dict
+
+from .file_manifest import FileManifest, to_arcname, content_hash_entry
+from .parallel_gzip import ParallelGzipWriter, DEFAULT_COMPRESSION_LEVEL
 
 HASH_READ_BUF_SIZE = 1000000
+DELETED_PATHS_MEMBER = '.backup_deleted_paths'
+STREAMING_HASH_QUEUE_SIZE = 256
+DEFAULT_COMPRESSION = 'gz'
+COMPRESSION_LEVELS = {'none': range(0),
+                      'gz': range(1, 10),
+                      'bz2': range(1, 10),
+                      'xz': range(0, 10)}
+
+
+def parse_compression(compression: str) -> Tuple[str, Optional[int]]:
+    """
+    Parses a compression with the format 'codec' or 'codec:level'
+
+    The codecs are none, gz, bz2 and xz, for example 'gz:1' or 'xz'
+
+    :raises:
+        ValueError: if the codec or the level are not valid
+
+    :param compression: the compression to parse
+    :return: a tuple (codec, level), the level is None if not specified
+    """
+    codec, _, level = compression.partition(':')
+    if codec not in COMPRESSION_LEVELS:
+        raise ValueError("Unknown compression codec '%s'" % codec)
+    if not level:
+        return codec, None
+    if not level.isdigit() or int(level) not in COMPRESSION_LEVELS[codec]:
+        raise ValueError("Invalid level '%s' for compression codec '%s'" % (level, codec))
+    return codec, int(level)
+
+
+class _HashingReader:
+    """
+    Wraps a file object updating some hashes with everything that is read from it
+    """
+
+    def __init__(self, fileobj, *hash_objects):
+        self.fileobj = fileobj
+        self.hash_objects = hash_objects
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        for hash_object in self.hash_objects:
+            hash_object.update(data)
+        return data
+
+
+class _HashingTarFile(tarfile.TarFile):
+    """
+    Tarfile that hashes the content of the regular files while they are added
+
+    The content hash is the same one BackupFile.get_hash calculates reading the archive back,
+    file_digests has the sha256 of every regular file by its name inside the archive
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.content_hash = hashlib.sha256()
+        self.file_digests = {}
+
+    def addfile(self, tarinfo, fileobj=None):
+        if fileobj is not None and tarinfo.isreg():
+            file_hash = hashlib.sha256()
+            super().addfile(tarinfo, _HashingReader(fileobj, file_hash))
+            self.file_digests[tarinfo.name] = file_hash.hexdigest()
+        else:
+            super().addfile(tarinfo, fileobj)
+            if tarinfo.islnk() and tarinfo.linkname in self.file_digests:
+                self.file_digests[tarinfo.name] = self.file_digests[tarinfo.linkname]
+        if tarinfo.name in self.file_digests:
+            self.content_hash.update(content_hash_entry(tarinfo.name, self.file_digests[tarinfo.name]))
+
+
+def _hash_archive(archive: tarfile.TarFile) -> Tuple[str, Dict[str, str]]:
+    """
+    Hashes the regular files of an archive opened for reading, works with stream archives
+
+    :param archive: the archive
+    :return: a tuple (hash of the archive, digests of the regular files by name)
+    """
+    sha256 = hashlib.sha256()
+    file_digests = {}
+    for member in archive:
+        if member.isfile():
+            file_hash = hashlib.sha256()
+            with archive.extractfile(member) as target:
+                while True:
+                    data = target.read(HASH_READ_BUF_SIZE)
+                    if not data:
+                        break
+                    file_hash.update(data)
+            file_digests[member.name] = file_hash.hexdigest()
+        elif member.islnk() and member.linkname in file_digests:
+            file_digests[member.name] = file_digests[member.linkname]
+        if member.name in file_digests:
+            sha256.update(content_hash_entry(member.name, file_digests[member.name]))
+    return sha256.hexdigest(), file_digests
+
+
+class _QueueReader:
+    """
+    Read only file object with the chunks put in a queue, None marks the end
+    """
+
+    def __init__(self, queue: Queue):
+        self.queue = queue
+        self.buffer = bytearray()
+        self.finished = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            chunk = self.queue.get()
+            if chunk is None:
+                self.finished = True
+            else:
+                self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def drain(self):
+        while not self.finished:
+            if self.queue.get() is None:
+                self.finished = True
+
+
+class StreamingHasher:
+    """
+    Write only file object that calculates BackupFile.get_hash of an archive while it is written
+
+    The written bytes are passed to the wrapped file object and parsed as an archive
+    in a background thread, so the archive does not have to be read again from disk.
+    """
+
+    def __init__(self, fileobj=None):
+        """
+        Creates a streaming hasher
+
+        :param fileobj: the file object where to write the bytes, it is not closed
+        """
+        self.fileobj = fileobj
+        self.queue = Queue(STREAMING_HASH_QUEUE_SIZE)
+        self.result = None
+        self.error = None
+        self.thread = Thread(target=self._hash, daemon=True)
+        self.thread.start()
+
+    def _hash(self):
+        reader = _QueueReader(self.queue)
+        try:
+            with tarfile.open(fileobj=reader, mode='r|*') as archive:
+                self.result = _hash_archive(archive)
+        except Exception as e:
+            self.error = e
+        reader.drain()
+
+    def write(self, data) -> int:
+        if self.fileobj is not None:
+            self.fileobj.write(data)
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def hexdigest(self) -> str:
+        """
+        Finishes the archive and gets its hash
+
+        :raises:
+            tarfile.TarError: if the written bytes are not a valid archive
+
+        :return: the hash of the archive
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error:
+            raise tarfile.TarError("Invalid archive: %s" % self.error)
+        return self.result[0]
+
+
+def _open_compressor(fileobj, codec: str, level: Optional[int], compression_workers: int):
+    """
+    Wraps a file object with a write only compressor, it is not closed with the compressor
+
+    :param fileobj: the file object where to write the compressed data
+    :param codec: the compression codec
+    :param level: the compression level or None for the default
+    :param compression_workers: the number of threads compressing gzip archives
+    :return: the compressor file object
+    """
+    if codec == 'gz':
+        if compression_workers > 1:
+            return ParallelGzipWriter(fileobj, compression_workers, compresslevel=level or DEFAULT_COMPRESSION_LEVEL)
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level or DEFAULT_COMPRESSION_LEVEL)
+    if codec == 'bz2':
+        return bz2.BZ2File(fileobj, mode='wb', compresslevel=level or 9)
+    return lzma.LZMAFile(fileobj, mode='wb', preset=level)
+
+
+@contextmanager
+def _open_archive(dst_path, compression: str, compression_workers: int):
+    """
+    Opens a hashing tarfile for writing with the compression
+
+    :param dst_path: the destination path, or a write only file object to write the archive as a stream
+    :param compression: the compression codec and level, see parse_compression
+    :param compression_workers: the number of threads compressing gzip archives
+    :return: the opened _HashingTarFile
+    """
+    codec, level = parse_compression(compression)
+    if not isinstance(dst_path, str):
+        if codec == 'none':
+            with _HashingTarFile.open(mode='w|', fileobj=dst_path) as archive:
+                yield archive
+        else:
+            with _open_compressor(dst_path, codec, level, compression_workers) as compressed_file:
+                with _HashingTarFile.open(mode='w|', fileobj=compressed_file) as archive:
+                    yield archive
+    elif codec == 'gz' and compression_workers > 1:
+        with open(dst_path, 'wb') as dst_file, \
+                _open_compressor(dst_file, codec, level, compression_workers) as gzip_file:
+            with _HashingTarFile.open(dst_path, mode='w|', fileobj=gzip_file) as archive:
+                yield archive
+    else:
+        if codec == 'none':
+            mode, kwargs = 'w', {}
+        elif codec == 'xz':
+            mode, kwargs = 'w:xz', ({'preset': level} if level is not None else {})
+        else:
+            mode, kwargs = 'w:' + codec, ({'compresslevel': level} if level is not None else {})
+        with _HashingTarFile.open(dst_path, mode=mode, **kwargs) as archive:
+            yield archive
 
 
 class BackupFile:
     def __init__(self, tarfile_path: str = None):
         self.tarfile_path = tarfile_path
         self.calculated_hash = None
+        self.file_digests = {}
 
     @classmethod
-    def create_from_path(cls, src_path: str, dst_path: str) -> 'BackupFile':
+    def create_from_path(cls, src_path: str, dst_path,
+                         compression: str = DEFAULT_COMPRESSION,
+                         compression_workers: int = 1) -> 'BackupFile':
         """
         Creates a new backup file in dst_path with the contents of src_path
 
+        The hash of the contents is calculated while the archive is written,
+        so calling get_hash on the returned object does not read the archive again
+
         :param src_path: the source path
-        :param dst_path: the destination path
-        :return: a BackupFile object
+        :param dst_path: the destination path, or a write only file object to stream the archive to
+        :param compression: the compression codec and level, see parse_compression
+        :param compression_workers: the number of threads compressing gzip archives
+        :return: a BackupFile object, without path if the archive was streamed
         """
-        with tarfile.open(dst_path, mode='w:gz') as archive:
+        with _open_archive(dst_path, compression, compression_workers) as archive:
             archive.add(src_path, recursive=True)
-        return cls(dst_path)
+        backup_file = cls(dst_path if isinstance(dst_path, str) else None)
+        backup_file.calculated_hash = archive.content_hash.hexdigest()
+        backup_file.file_digests = archive.file_digests
+        return backup_file
+
+    @classmethod
+    def create_incremental(cls, src_path: str, dst_path,
+                           previous_manifest: Optional[FileManifest],
+                           compression: str = DEFAULT_COMPRESSION,
+                           compression_workers: int = 1) -> Tuple['BackupFile', FileManifest]:
+        """
+        Creates a backup file in dst_path with what changed in src_path since the previous manifest
+
+        Regular files are added only if their metadata changed, directories and other
+        special files are always added. The paths that no longer exist are listed in
+        the DELETED_PATHS_MEMBER member. Without a previous manifest everything is added.
+
+        :param src_path: the source path
+        :param dst_path: the destination path, or a write only file object to stream the archive to
+        :param previous_manifest: the manifest of the backup to use as base
+        :param compression: the compression codec and level, see parse_compression
+        :param compression_workers: the number of threads compressing gzip archives
+        :return: a tuple (BackupFile object, manifest of src_path)
+        """
+        manifest = FileManifest.scan_metadata(src_path, previous_manifest)
+        deleted_paths = manifest.deleted_paths(previous_manifest) if previous_manifest else []
+        pending_paths = manifest.pending_paths()
+        with _open_archive(dst_path, compression, compression_workers) as archive:
+            for path in pending_paths:
+                archive.add(path, recursive=False)
+            deleted_data = json.dumps([to_arcname(path) for path in deleted_paths]).encode('utf-8')
+            tarinfo = tarfile.TarInfo(DELETED_PATHS_MEMBER)
+            tarinfo.size = len(deleted_data)
+            tarinfo.mtime = int(time.time())
+            archive.addfile(tarinfo, io.BytesIO(deleted_data))
+        manifest.fill_digests(archive.file_digests)
+        backup_file = cls(dst_path if isinstance(dst_path, str) else None)
+        backup_file.calculated_hash = archive.content_hash.hexdigest()
+        backup_file.file_digests = archive.file_digests
+        return backup_file, manifest
+
+    @staticmethod
+    def extract_chain(backup_paths: List[str], dst_path: str):
+        """
+        Rebuilds a backup extracting a full backup file followed by its incremental ones
+
+        :param backup_paths: the paths of the backup files, from the full one to the newest
+        :param dst_path: the path where to extract the backup
+        """
+        for backup_path in backup_paths:
+            with tarfile.open(backup_path, 'r:*') as archive:
+                members = []
+                for member in archive.getmembers():
+                    if member.name != DELETED_PATHS_MEMBER:
+                        members.append(member)
+                        continue
+                    with archive.extractfile(member) as deleted_file:
+                        for deleted_path in json.load(deleted_file):
+                            deleted_path = os.path.join(dst_path, deleted_path)
+                            if os.path.isdir(deleted_path) and not os.path.islink(deleted_path):
+                                shutil.rmtree(deleted_path)
+                            elif os.path.lexists(deleted_path):
+                                os.remove(deleted_path)
+                archive.extractall(dst_path, members)
 
     def get_hash(self) -> str:
         """
         Gets a hash of the file
 
+        It is the sha256 of the names and sha256 digests of the regular files, in archive order,
+        so it can also be calculated from a FileManifest without reading the files
+
         :return: a hash of the file
         """
-        assert self.tarfile_path
         if self.calculated_hash:
             return self.calculated_hash
-        sha256 = hashlib.sha256()
-        archive = tarfile.open(self.tarfile_path, 'r:gz')
-        for member in archive.getmembers():
-            if member.isfile():
-                with archive.extractfile(member) as target:
-                    while True:
-                        data = target.read(HASH_READ_BUF_SIZE)
-                        if not data:
-                            break
-                        sha256.update(data)
-        archive.close()
-        self.calculated_hash = sha256.hexdigest()
-        return sha256.hexdigest()
+        assert self.tarfile_path
+        with tarfile.open(self.tarfile_path, 'r:*') as archive:
+            self.calculated_hash, self.file_digests = _hash_archive(archive)
+        return self.calculated_hash
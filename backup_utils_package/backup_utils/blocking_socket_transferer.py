@@ -1,19 +1,106 @@
 import os
 import socket
+import struct
+from typing import Optional
 
 DEFAULT_SOCKET_BUFFER_SIZE = 4096
+DEFAULT_FILE_CHUNK_SIZE = 1024 * 1024
 OK_MESSAGE = "OK"
 OK_MESSAGE_LEN = len(OK_MESSAGE.encode('utf-8'))
 SIZE_NUMBER_SIZE = 20
 
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+LATEST_PROTOCOL = PROTOCOL_V2
+V2_MAGIC = 0xB2
+V2_HEADER = struct.Struct('!BBHQ')
+MESSAGE_TYPE_TEXT = 1
+MESSAGE_TYPE_OK = 2
+MESSAGE_TYPE_FILE = 3
+MESSAGE_TYPE_FILE_CHUNK = 4
+FLAG_LAST_CHUNK = 1
+
 
 class SocketClosed(Exception):
     pass
 
 
+class ProtocolError(Exception):
+    pass
+
+
+class FileStream:
+    """
+    Write only file object that sends a file of unknown size as chunk frames of the protocol v2
+
+    Closing it sends the last chunk and waits the receiver confirmation. If it is left
+    with an exception the last chunk is not sent, so the sender should abort the transferer.
+    """
+
+    def __init__(self, transferer: 'BlockingSocketTransferer', chunk_size: int):
+        self.transferer = transferer
+        self.chunk_size = chunk_size
+        self.buffer = bytearray(V2_HEADER.size)
+        self.closed = False
+
+    def _send_chunk(self, flags: int = 0):
+        V2_HEADER.pack_into(self.buffer, 0, V2_MAGIC, MESSAGE_TYPE_FILE_CHUNK, flags,
+                            len(self.buffer) - V2_HEADER.size)
+        self.transferer.socket.sendall(self.buffer)
+        del self.buffer[V2_HEADER.size:]
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer += data
+        if len(self.buffer) - V2_HEADER.size >= self.chunk_size:
+            self._send_chunk()
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._send_chunk(FLAG_LAST_CHUNK)
+        self.transferer.receive_ok()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+
+
 class BlockingSocketTransferer:
-    def __init__(self, socket: socket):
+    """
+    Sends and receives framed messages and files through a blocking socket
+
+    There are two wire formats. In the protocol v1 every frame starts with its length
+    as SIZE_NUMBER_SIZE zero padded ascii digits. In the protocol v2 every frame starts with
+    a V2_HEADER with V2_MAGIC, the message type, flags and the length. The magic is not an
+    ascii digit, so received frames are detected as v1 or v2 and the transferer answers with
+    the version the peer used last.
+    """
+
+    def __init__(self, socket: socket, file_chunk_size: int = DEFAULT_FILE_CHUNK_SIZE,
+                 zero_copy: bool = True, protocol_version: int = PROTOCOL_V1):
+        """
+        Creates a transferer over a connected socket
+
+        :param socket: the connected socket
+        :param file_chunk_size: the size of the chunks used to receive files
+        :param zero_copy: whether to send files with sendfile and receive them into a reusable buffer,
+        if false files are copied through python in chunks of file_chunk_size
+        :param protocol_version: the protocol used to send until a frame is received
+        """
         self.socket = socket
+        self.file_chunk_size = file_chunk_size
+        self.zero_copy = zero_copy
+        self.protocol_version = protocol_version
+        self._file_buffer = None
 
     def controlled_recv(self, size: int) -> bytes:
         data = self.socket.recv(size)
@@ -21,61 +108,147 @@ class BlockingSocketTransferer:
             raise SocketClosed
         return data
 
+    def receive_exact(self, size: int) -> bytearray:
+        """
+        Receives exactly size bytes
+
+        :raises:
+            SocketClosed: if the socket is closed before
+
+        :param size: the number of bytes
+        :return: the bytes received
+        """
+        data = bytearray(size)
+        view = memoryview(data)
+        recv_size = 0
+        while recv_size < size:
+            received = self.socket.recv_into(view[recv_size:], size - recv_size)
+            if received == 0:
+                raise SocketClosed
+            recv_size += received
+        return data
+
     @staticmethod
     def size_to_bytes_number(size: int) -> bytes:
         text = str(size)
         return text.zfill(SIZE_NUMBER_SIZE).encode('ascii')
 
+    def _frame_header(self, message_type: int, size: int, flags: int = 0) -> bytes:
+        if self.protocol_version >= PROTOCOL_V2:
+            return V2_HEADER.pack(V2_MAGIC, message_type, flags, size)
+        return self.size_to_bytes_number(size)
+
+    def _receive_frame_header(self):
+        """
+        Receives the header of a frame of any protocol version
+
+        :return: a tuple (message type, flags, length), v1 frames have MESSAGE_TYPE_TEXT
+        """
+        first_byte = self.receive_exact(1)
+        if first_byte[0] == V2_MAGIC:
+            _, message_type, flags, size = V2_HEADER.unpack(first_byte + self.receive_exact(V2_HEADER.size - 1))
+            self.protocol_version = PROTOCOL_V2
+            return message_type, flags, size
+        self.protocol_version = PROTOCOL_V1
+        return MESSAGE_TYPE_TEXT, 0, int(first_byte + self.receive_exact(SIZE_NUMBER_SIZE - 1))
+
     def receive_fixed_size(self, size) -> str:
-        data = ""
-        recv_size = 0
-        while recv_size < size:
-            new_data = self.controlled_recv(size - recv_size)
-            recv_size += len(new_data)
-            data += new_data.decode('ascii')
-        return data
+        return self.receive_exact(size).decode('ascii')
 
     def send_ok(self):
-        self.send_plain_text(OK_MESSAGE)
+        if self.protocol_version >= PROTOCOL_V2:
+            self.socket.sendall(self._frame_header(MESSAGE_TYPE_OK, 0))
+        else:
+            self.send_plain_text(OK_MESSAGE)
 
     def receive_ok(self):
         text = self.receive_plain_text()
         assert text == OK_MESSAGE
 
     def receive_file_data(self, file):
-        file_size = int(self.receive_fixed_size(SIZE_NUMBER_SIZE))
-        self.send_ok()
-        while file_size > 0:
-            buffer = self.controlled_recv(DEFAULT_SOCKET_BUFFER_SIZE)
-            file.write(buffer)
-            file_size -= len(buffer)
+        """
+        Receives a file sent with send_file or with a FileStream
+
+        In the protocol v1 the size is acknowledged before the data is sent,
+        in the protocol v2 the data follows the header without waiting
+
+        :raises:
+            ProtocolError: if a stream is interrupted by another message, like an abort
+
+        :param file: a file object where to write the data, it may be given memoryviews
+        that are reused after the write returns
+        """
+        message_type, flags, file_size = self._receive_frame_header()
+        if self.protocol_version == PROTOCOL_V1:
+            self.send_ok()
+        self._receive_data(file, file_size)
+        while message_type == MESSAGE_TYPE_FILE_CHUNK and not flags & FLAG_LAST_CHUNK:
+            message_type, flags, chunk_size = self._receive_frame_header()
+            if message_type != MESSAGE_TYPE_FILE_CHUNK:
+                raise ProtocolError("File stream interrupted by a message of type %d" % message_type)
+            self._receive_data(file, chunk_size)
         self.send_ok()
 
-    def send_file(self, filename):
-        file_size = os.stat(filename).st_size
-        self.socket.sendall(self.size_to_bytes_number(file_size))
-        self.receive_ok()
-        with open(filename, "rb") as file:
+    def _receive_data(self, file, file_size: int):
+        if self.zero_copy:
+            if self._file_buffer is None:
+                self._file_buffer = memoryview(bytearray(self.file_chunk_size))
             while file_size > 0:
-                buffer = file.read(DEFAULT_SOCKET_BUFFER_SIZE)
-                self.socket.sendall(buffer)
-                file_size -= DEFAULT_SOCKET_BUFFER_SIZE
+                received = self.socket.recv_into(self._file_buffer, min(file_size, self.file_chunk_size))
+                if received == 0:
+                    raise SocketClosed
+                file.write(self._file_buffer[:received])
+                file_size -= received
+        else:
+            while file_size > 0:
+                buffer = self.controlled_recv(min(file_size, self.file_chunk_size))
+                file.write(buffer)
+                file_size -= len(buffer)
+
+    def send_file(self, filename, offset: int = 0, length: Optional[int] = None):
+        """
+        Sends a file, with sendfile if zero_copy is set so the data is not copied to user space
+
+        :param filename: the path of the file
+        :param offset: the position of the file where to start sending, to resume a transfer
+        :param length: the maximum bytes to send from offset, to send a range of the file, if None sends until the end
+        """
+        file_size = max(os.stat(filename).st_size - offset, 0)
+        if length is not None:
+            file_size = min(file_size, length)
+        self.socket.sendall(self._frame_header(MESSAGE_TYPE_FILE, file_size))
+        if self.protocol_version == PROTOCOL_V1:
+            self.receive_ok()
+        with open(filename, "rb") as file:
+            if self.zero_copy:
+                if file_size > 0:
+                    self.socket.sendfile(file, offset, file_size)
+            else:
+                file.seek(offset)
+                while file_size > 0:
+                    buffer = file.read(min(file_size, self.file_chunk_size))
+                    self.socket.sendall(buffer)
+                    file_size -= len(buffer)
         self.receive_ok()
 
+    def open_file_stream(self) -> FileStream:
+        """
+        Opens a stream to send a file whose size is not known upfront, it needs the protocol v2
+
+        :return: the FileStream, it sends chunks of file_chunk_size
+        """
+        assert self.protocol_version >= PROTOCOL_V2
+        return FileStream(self, self.file_chunk_size)
+
     def send_plain_text(self, text):
         encoded_text = text.encode('utf-8')
-        self.socket.sendall(self.size_to_bytes_number(len(encoded_text)))
-        self.socket.sendall(encoded_text)
+        self.socket.sendall(self._frame_header(MESSAGE_TYPE_TEXT, len(encoded_text)) + encoded_text)
 
     def receive_plain_text(self) -> str:
-        size_to_recv = int(self.receive_fixed_size(SIZE_NUMBER_SIZE))
-        result = ""
-        recv_size = 0
-        while recv_size < size_to_recv:
-            new_data = self.controlled_recv(size_to_recv - recv_size)
-            result += new_data.decode('utf-8')
-            recv_size += len(new_data)
-        return result
+        message_type, _, size_to_recv = self._receive_frame_header()
+        if message_type == MESSAGE_TYPE_OK:
+            return OK_MESSAGE
+        return self.receive_exact(size_to_recv).decode('utf-8')
 
     def abort(self):
         self.send_plain_text("ABORT")
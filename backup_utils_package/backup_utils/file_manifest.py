@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import stat
+from typing import Dict, List, NamedTuple, Optional, Iterator
+
+
+class ManifestEntry(NamedTuple):
+    """
+    Metadata of a path inside a backup
+
+    The digest is empty for everything that is not a regular file
+    """
+    size: int
+    mtime_ns: int
+    inode: int
+    digest: str = ""
+    is_file: bool = True
+
+    def same_metadata(self, other: 'ManifestEntry') -> bool:
+        """
+        Checks whether the metadata says the content of the path did not change
+
+        :param other: the other entry
+        :return: a boolean
+        """
+        return self.is_file == other.is_file and self.size == other.size and \
+               self.mtime_ns == other.mtime_ns and self.inode == other.inode
+
+
+def content_hash_entry(arcname: str, digest: str) -> bytes:
+    """
+    Gets the data that a regular file adds to the hash of the contents of a backup
+
+    :param arcname: the name of the file inside the archive
+    :param digest: the sha256 hexdigest of the file content
+    :return: the data to update the hash with
+    """
+    return ("%s\0%s\n" % (arcname, digest)).encode('utf-8')
+
+
+def to_arcname(path: str) -> str:
+    """
+    Converts a filesystem path to the name tarfile gives it inside an archive
+
+    :param path: the path
+    :return: the name inside the archive
+    """
+    return path.replace(os.sep, "/").lstrip("/")
+
+
+def walk_path(src_path: str) -> Iterator[str]:
+    """
+    Walks a path in the same order that tarfile adds it to an archive
+
+    :param src_path: the path to walk
+    :return: an iterator of paths
+    """
+    yield src_path
+    if os.path.isdir(src_path) and not os.path.islink(src_path):
+        for name in sorted(os.listdir(src_path)):
+            yield from walk_path(os.path.join(src_path, name))
+
+
+class FileManifest:
+    """
+    The list of paths of a backup with their metadata and content digests
+
+    Paths are kept in the order they are added to the archives
+    """
+
+    def __init__(self, entries: Optional[Dict[str, ManifestEntry]] = None):
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def scan_metadata(cls, src_path: str, previous: Optional['FileManifest'] = None) -> 'FileManifest':
+        """
+        Scans the metadata of src_path without reading the files
+
+        Regular files whose metadata did not change since the previous manifest keep
+        their digest, the others are left with an empty digest
+
+        :param src_path: the path to scan
+        :param previous: the previous manifest of the path
+        :return: the new manifest
+        """
+        previous_entries = previous.entries if previous else {}
+        entries = {}
+        for path in walk_path(src_path):
+            path_stat = os.lstat(path)
+            entry = ManifestEntry(size=path_stat.st_size, mtime_ns=path_stat.st_mtime_ns,
+                                  inode=path_stat.st_ino, is_file=stat.S_ISREG(path_stat.st_mode))
+            previous_entry = previous_entries.get(path)
+            if entry.is_file and previous_entry and previous_entry.same_metadata(entry):
+                entry = previous_entry
+            entries[path] = entry
+        return cls(entries)
+
+    def is_complete(self) -> bool:
+        """
+        Checks whether all the regular files have a digest
+
+        :return: a boolean
+        """
+        return all(entry.digest for entry in self.entries.values() if entry.is_file)
+
+    def fill_digests(self, file_digests: Dict[str, str]):
+        """
+        Sets the digests of the regular files that do not have one
+
+        :param file_digests: the digests by name inside the archive
+        """
+        for path, entry in self.entries.items():
+            if entry.is_file and not entry.digest and to_arcname(path) in file_digests:
+                self.set_digest(path, file_digests[to_arcname(path)])
+
+    def pending_paths(self) -> List[str]:
+        """
+        Lists the regular files without a digest plus everything that is not a regular file
+
+        :return: a list of paths
+        """
+        return [path for path, entry in self.entries.items() if not entry.is_file or not entry.digest]
+
+    def deleted_paths(self, previous: 'FileManifest') -> List[str]:
+        """
+        Lists the paths of the previous manifest that no longer exist
+
+        :param previous: the previous manifest
+        :return: a list of paths
+        """
+        return [path for path in previous.entries if path not in self.entries]
+
+    def set_digest(self, path: str, digest: str):
+        """
+        Sets the content digest of a regular file
+
+        :param path: the path
+        :param digest: the sha256 hexdigest of the content
+        """
+        self.entries[path] = self.entries[path]._replace(digest=digest)
+
+    def get_hash(self) -> str:
+        """
+        Gets a hash of the names and contents of all the regular files
+
+        :return: the hash
+        """
+        sha256 = hashlib.sha256()
+        for path, entry in self.entries.items():
+            if entry.is_file:
+                sha256.update(content_hash_entry(to_arcname(path), entry.digest))
+        return sha256.hexdigest()
+
+    def save(self, manifest_path: str):
+        """
+        Saves the manifest
+
+        :param manifest_path: the path of the file where to save it
+        """
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump([[path] + list(entry) for path, entry in self.entries.items()], manifest_file)
+
+    @classmethod
+    def load(cls, manifest_path: str) -> 'FileManifest':
+        """
+        Loads a manifest
+
+        :param manifest_path: the path of the file where it was saved
+        :return: the manifest
+        """
+        with open(manifest_path, 'r') as manifest_file:
+            return cls({data[0]: ManifestEntry(*data[1:]) for data in json.load(manifest_file)})
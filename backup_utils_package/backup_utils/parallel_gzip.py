@@ -0,0 +1,110 @@
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_BLOCK_SIZE = 128 * 1024
+DEFAULT_COMPRESSION_LEVEL = 9
+DICTIONARY_SIZE = 32 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_DEFLATE_METHOD = 8
+GZIP_UNKNOWN_OS = 255
+PENDING_BLOCKS_PER_WORKER = 2
+
+
+def _compress_block(data: bytes, dictionary: bytes, level: int) -> bytes:
+    """
+    Compresses a block as raw deflate data ending in a byte aligned sync flush
+
+    :param data: the data to compress
+    :param dictionary: the tail of the previous block to prime the compressor
+    :param level: the compression level
+    :return: the raw deflate data
+    """
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter:
+    """
+    Write only file object that compresses gzip blocks in a pool of threads
+
+    Works like pigz: the stream is split in blocks, every block is compressed
+    independently (primed with the last 32KB of the previous one) and the
+    results are concatenated into a single valid gzip member.
+    zlib releases the GIL while compressing so threads use multiple cores.
+    """
+
+    def __init__(self, fileobj, workers: int,
+                 compresslevel: int = DEFAULT_COMPRESSION_LEVEL,
+                 block_size: int = DEFAULT_BLOCK_SIZE):
+        """
+        Creates a parallel gzip writer
+
+        :param fileobj: the file object where to write the gzip stream, it is not closed
+        :param workers: the number of compression threads
+        :param compresslevel: the compression level
+        :param block_size: the size of the uncompressed blocks
+        """
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.max_pending = workers * PENDING_BLOCKS_PER_WORKER
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending_blocks = deque()
+        self.buffer = bytearray()
+        self.previous_block = b''
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        self._write_header()
+
+    def _write_header(self):
+        self.fileobj.write(GZIP_MAGIC + struct.pack('<BBIBB', GZIP_DEFLATE_METHOD, 0,
+                                                    int(time.time()), 0, GZIP_UNKNOWN_OS))
+
+    def _submit_block(self, block: bytes):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending_blocks.append(self.executor.submit(_compress_block, block,
+                                                        self.previous_block[-DICTIONARY_SIZE:],
+                                                        self.compresslevel))
+        self.previous_block = block
+        while len(self.pending_blocks) > self.max_pending:
+            self.fileobj.write(self.pending_blocks.popleft().result())
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit_block(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        """
+        Flushes all the pending blocks and writes the gzip trailer
+        """
+        if self.closed:
+            return
+        if self.buffer:
+            self._submit_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending_blocks:
+            self.fileobj.write(self.pending_blocks.popleft().result())
+        self.executor.shutdown()
+        self.fileobj.write(zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                            -zlib.MAX_WBITS).flush(zlib.Z_FINISH))
+        self.fileobj.write(struct.pack('<II', self.crc, self.size & 0xffffffff))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
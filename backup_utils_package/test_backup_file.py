@@ -1,8 +1,11 @@
+import filecmp
 import os
 import shutil
+import tarfile
 import unittest
 
-from backup_utils.backup_file import BackupFile
+from backup_utils.backup_file import BackupFile, parse_compression, StreamingHasher
+from backup_utils.file_manifest import FileManifest
 
 
 class TestBackupFile(unittest.TestCase):
@@ -24,3 +27,108 @@ class TestBackupFile(unittest.TestCase):
         backup_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz')
         backup_file2 = BackupFile.create_from_path('/tmp/test_path', '/tmp/file2.tgz')
         self.assertEqual(backup_file2.get_hash(), backup_file.get_hash())
+
+    def test_hash_while_creating_equals_hash_reading_archive(self):
+        os.mkdir('/tmp/test_path/subdir')
+        with open('/tmp/test_path/subdir/other_file', "w") as test_file:
+            test_file.write("other dummy text" * 10000)
+        open('/tmp/test_path/subdir/empty_file', "w").close()
+        backup_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz')
+        self.assertIsNotNone(backup_file.calculated_hash)
+        self.assertEqual(BackupFile('/tmp/file.tgz').get_hash(), backup_file.get_hash())
+
+    def test_parallel_compression_same_hash(self):
+        backup_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz')
+        backup_file2 = BackupFile.create_from_path('/tmp/test_path', '/tmp/file2.tgz',
+                                                   compression_workers=4)
+        self.assertEqual(BackupFile('/tmp/file2.tgz').get_hash(), backup_file.get_hash())
+        self.assertEqual(backup_file2.get_hash(), backup_file.get_hash())
+
+    def test_all_compressions_same_hash(self):
+        backup_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz')
+        for compression in ['none', 'gz:1', 'bz2', 'bz2:1', 'xz', 'xz:0']:
+            backup_file2 = BackupFile.create_from_path('/tmp/test_path', '/tmp/file2.tgz',
+                                                       compression=compression)
+            self.assertEqual(BackupFile('/tmp/file2.tgz').get_hash(), backup_file.get_hash())
+            self.assertEqual(backup_file2.get_hash(), backup_file.get_hash())
+
+    def test_parse_compression(self):
+        self.assertEqual(parse_compression('gz'), ('gz', None))
+        self.assertEqual(parse_compression('xz:0'), ('xz', 0))
+        for compression in ['zip', 'gz:0', 'gz:10', 'none:1', 'bz2:a']:
+            with self.assertRaises(ValueError):
+                parse_compression(compression)
+
+    def _assert_same_tree(self, expected_path, actual_path):
+        comparison = filecmp.dircmp(expected_path, actual_path)
+        self.assertEqual(comparison.left_only, [])
+        self.assertEqual(comparison.right_only, [])
+        _, mismatch, errors = filecmp.cmpfiles(expected_path, actual_path, comparison.common_files,
+                                               shallow=False)
+        self.assertEqual(mismatch + errors, [])
+        for subdir in comparison.common_dirs:
+            self._assert_same_tree(os.path.join(expected_path, subdir), os.path.join(actual_path, subdir))
+
+    def test_incremental_chain_rebuilds_each_step(self):
+        shutil.rmtree('/tmp/test_restore', ignore_errors=True)
+        os.mkdir('/tmp/test_path/subdir')
+        with open('/tmp/test_path/subdir/other_file', "w") as test_file:
+            test_file.write("other dummy text")
+        full_backup, manifest = BackupFile.create_incremental('/tmp/test_path', '/tmp/file.tgz', None)
+        self.assertEqual(BackupFile('/tmp/file.tgz').get_hash(), full_backup.get_hash())
+        os.remove('/tmp/test_path/test_file')
+        with open('/tmp/test_path/subdir/new_file', "w") as test_file:
+            test_file.write("new dummy text")
+        incremental_backup, new_manifest = BackupFile.create_incremental('/tmp/test_path', '/tmp/file2.tgz',
+                                                                         manifest)
+        self.assertEqual(BackupFile('/tmp/file2.tgz').get_hash(), incremental_backup.get_hash())
+        self.assertNotEqual(manifest.get_hash(), new_manifest.get_hash())
+        BackupFile.extract_chain(['/tmp/file.tgz', '/tmp/file2.tgz'], '/tmp/test_restore')
+        self._assert_same_tree('/tmp/test_path', '/tmp/test_restore/tmp/test_path')
+        _, same_manifest = BackupFile.create_incremental('/tmp/test_path', '/tmp/file3.tgz', new_manifest)
+        self.assertEqual(same_manifest.get_hash(), new_manifest.get_hash())
+        shutil.rmtree('/tmp/test_restore', ignore_errors=True)
+
+    def test_manifest_hash_equals_backup_file_hash(self):
+        os.mkdir('/tmp/test_path/subdir')
+        with open('/tmp/test_path/subdir/other_file', "w") as test_file:
+            test_file.write("other dummy text")
+        os.link('/tmp/test_path/subdir/other_file', '/tmp/test_path/subdir/z_link')
+        os.symlink('/tmp/test_path/test_file', '/tmp/test_path/symlink')
+        backup_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz')
+        manifest = FileManifest.scan_metadata('/tmp/test_path')
+        manifest.fill_digests(backup_file.file_digests)
+        self.assertTrue(manifest.is_complete())
+        self.assertEqual(manifest.get_hash(), backup_file.get_hash())
+        self.assertEqual(BackupFile('/tmp/file.tgz').get_hash(), backup_file.get_hash())
+
+    def test_streaming_hasher_same_hash(self):
+        with open('/tmp/test_path/big_file', "w") as test_file:
+            test_file.write("big dummy text" * 100000)
+        for compression in ['gz', 'none', 'xz']:
+            backup_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz', compression=compression)
+            with open('/tmp/file2.tgz', 'wb') as copy_file:
+                hasher = StreamingHasher(copy_file)
+                with open('/tmp/file.tgz', 'rb') as original_file:
+                    while True:
+                        data = original_file.read(4096)
+                        if not data:
+                            break
+                        hasher.write(data)
+                self.assertEqual(hasher.hexdigest(), backup_file.get_hash())
+            self.assertEqual(BackupFile('/tmp/file2.tgz').get_hash(), backup_file.get_hash())
+
+    def test_streaming_hasher_invalid_archive(self):
+        hasher = StreamingHasher()
+        hasher.write(b"not an archive" * 1000)
+        with self.assertRaises(tarfile.TarError):
+            hasher.hexdigest()
+
+    def test_create_into_file_object_same_hash(self):
+        expected_file = BackupFile.create_from_path('/tmp/test_path', '/tmp/file.tgz')
+        for compression, compression_workers in [('gz', 1), ('gz', 2), ('none', 1), ('bz2', 1), ('xz:1', 1)]:
+            with open('/tmp/file2.tgz', 'wb') as stream_file:
+                backup_file = BackupFile.create_from_path('/tmp/test_path', stream_file, compression=compression,
+                                                          compression_workers=compression_workers)
+            self.assertEqual(backup_file.get_hash(), expected_file.get_hash())
+            self.assertEqual(BackupFile('/tmp/file2.tgz').get_hash(), expected_file.get_hash())
@@ -4,27 +4,28 @@ import socket
 import unittest
 from multiprocessing import Barrier, Process
 
-from backup_utils.blocking_socket_transferer import BlockingSocketTransferer
+from backup_utils.blocking_socket_transferer import BlockingSocketTransferer, PROTOCOL_V1, PROTOCOL_V2
 
 
-def message_sender(barrier, port):
+def message_sender(barrier, port, text="Hola uacho", protocol_version=PROTOCOL_V1):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.bind(('', port))
     sock.listen(1)
     barrier.wait()
     c, addr = sock.accept()
-    transferer = BlockingSocketTransferer(c)
-    transferer.send_plain_text("Hola uacho")
+    transferer = BlockingSocketTransferer(c, protocol_version=protocol_version)
+    transferer.send_plain_text(text)
+    transferer.receive_ok()
     c.close()
 
 
-def file_sender(barrier, port, input_file):
+def file_sender(barrier, port, input_file, zero_copy=True, protocol_version=PROTOCOL_V1):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.bind(('', port))
     sock.listen(1)
     barrier.wait()
     c, addr = sock.accept()
-    transferer = BlockingSocketTransferer(c)
+    transferer = BlockingSocketTransferer(c, zero_copy=zero_copy, protocol_version=protocol_version)
     transferer.send_file(input_file)
     transferer.close()
 
@@ -54,9 +55,24 @@ class TestBlockingSocketTransferer(unittest.TestCase):
         sock.connect(('localhost', TestBlockingSocketTransferer.TEST_PORT))
         socket_transferer = BlockingSocketTransferer(sock)
         self.assertEqual(socket_transferer.receive_plain_text(), "Hola uacho")
+        socket_transferer.send_ok()
         socket_transferer.close()
 
-    def test_send_file(self):
+    def test_send_text_v2_is_detected(self):
+        text = "Acción ñandú 🐧" * 100000
+        self.p = Process(target=message_sender, args=(self.barrier, TestBlockingSocketTransferer.TEST_PORT,
+                                                      text, PROTOCOL_V2))
+        self.p.start()
+        self.barrier.wait()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(('localhost', TestBlockingSocketTransferer.TEST_PORT))
+        socket_transferer = BlockingSocketTransferer(sock)
+        self.assertEqual(socket_transferer.receive_plain_text(), text)
+        self.assertEqual(socket_transferer.protocol_version, PROTOCOL_V2)
+        socket_transferer.send_ok()
+        socket_transferer.close()
+
+    def _send_file(self, zero_copy, file_chunk_size, protocol_version=PROTOCOL_V1):
         with open('/tmp/big_dummy_file_test', 'wb') as dummy_file:
             for i in range(100000):
                 dummy_file.write(("%d%d%d" % (i, i, i)).encode('utf-8'))
@@ -70,12 +86,12 @@ class TestBlockingSocketTransferer(unittest.TestCase):
         original_hash = sha256.hexdigest()
 
         self.p = Process(target=file_sender, args=(self.barrier, TestBlockingSocketTransferer.TEST_PORT,
-                                                   '/tmp/big_dummy_file_test'))
+                                                   '/tmp/big_dummy_file_test', zero_copy, protocol_version))
         self.p.start()
         self.barrier.wait()
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect(('localhost', TestBlockingSocketTransferer.TEST_PORT))
-        socket_transferer = BlockingSocketTransferer(sock)
+        socket_transferer = BlockingSocketTransferer(sock, file_chunk_size=file_chunk_size, zero_copy=zero_copy)
         with open('/tmp/big_dummy_file_test_out', 'wb') as write_file:
             socket_transferer.receive_file_data(write_file)
         sha256 = hashlib.sha256()
@@ -89,3 +105,12 @@ class TestBlockingSocketTransferer(unittest.TestCase):
         os.remove('/tmp/big_dummy_file_test')
         os.remove('/tmp/big_dummy_file_test_out')
         socket_transferer.close()
+
+    def test_send_file(self):
+        self._send_file(zero_copy=True, file_chunk_size=65536)
+
+    def test_send_file_without_zero_copy(self):
+        self._send_file(zero_copy=False, file_chunk_size=4096)
+
+    def test_send_file_v2(self):
+        self._send_file(zero_copy=True, file_chunk_size=65536, protocol_version=PROTOCOL_V2)
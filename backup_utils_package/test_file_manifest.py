@@ -0,0 +1,42 @@
+import os
+import shutil
+import unittest
+
+from backup_utils.file_manifest import FileManifest
+
+
+class TestFileManifest(unittest.TestCase):
+    def setUp(self) -> None:
+        shutil.rmtree('/tmp/test_path', ignore_errors=True)
+        os.mkdir('/tmp/test_path')
+        with open('/tmp/test_path/test_file', "w") as test_file:
+            test_file.write("dummy text")
+
+    def tearDown(self) -> None:
+        shutil.rmtree('/tmp/test_path', ignore_errors=True)
+        if os.path.exists('/tmp/manifest.json'):
+            os.remove('/tmp/manifest.json')
+
+    def test_scan_keeps_digests_of_unchanged_files(self):
+        manifest = FileManifest.scan_metadata('/tmp/test_path')
+        self.assertEqual(manifest.pending_paths(), ['/tmp/test_path', '/tmp/test_path/test_file'])
+        manifest.set_digest('/tmp/test_path/test_file', 'digest')
+        manifest.save('/tmp/manifest.json')
+        manifest = FileManifest.load('/tmp/manifest.json')
+        new_manifest = FileManifest.scan_metadata('/tmp/test_path', manifest)
+        self.assertEqual(new_manifest.pending_paths(), ['/tmp/test_path'])
+        self.assertEqual(new_manifest.get_hash(), manifest.get_hash())
+
+    def test_scan_detects_changes_and_deletions(self):
+        manifest = FileManifest.scan_metadata('/tmp/test_path')
+        manifest.set_digest('/tmp/test_path/test_file', 'digest')
+        with open('/tmp/test_path/test_file', "w") as test_file:
+            test_file.write("other dummy text")
+        with open('/tmp/test_path/new_file', "w") as test_file:
+            test_file.write("new")
+        new_manifest = FileManifest.scan_metadata('/tmp/test_path', manifest)
+        self.assertEqual(new_manifest.pending_paths(), ['/tmp/test_path', '/tmp/test_path/new_file',
+                                                        '/tmp/test_path/test_file'])
+        os.remove('/tmp/test_path/test_file')
+        new_manifest = FileManifest.scan_metadata('/tmp/test_path', manifest)
+        self.assertEqual(new_manifest.deleted_paths(manifest), ['/tmp/test_path/test_file'])
@@ -0,0 +1,31 @@
+import gzip
+import io
+import os
+import unittest
+import zlib
+
+from backup_utils.parallel_gzip import ParallelGzipWriter
+
+
+class TestParallelGzipWriter(unittest.TestCase):
+    def test_decompress_multiple_blocks(self):
+        data = b''.join([("%d%d%d" % (i, i, i)).encode('utf-8') for i in range(100000)])
+        output = io.BytesIO()
+        with ParallelGzipWriter(output, 4, block_size=4096) as writer:
+            for i in range(0, len(data), 1000):
+                writer.write(data[i:i + 1000])
+        self.assertEqual(gzip.decompress(output.getvalue()), data)
+
+    def test_decompress_empty(self):
+        output = io.BytesIO()
+        ParallelGzipWriter(output, 2).close()
+        self.assertEqual(gzip.decompress(output.getvalue()), b'')
+
+    def test_random_data_crc(self):
+        data = os.urandom(300000)
+        output = io.BytesIO()
+        with ParallelGzipWriter(output, 3, block_size=65536) as writer:
+            writer.write(data)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(output.getvalue()), data)
+        self.assertTrue(decompressor.eof)
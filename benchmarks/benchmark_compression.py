@@ -0,0 +1,81 @@
+"""
+Compares the throughput and compression ratio of the backup file compressions
+
+Usage: PYTHONPATH=backup_utils_package python benchmarks/benchmark_compression.py [--mb 64]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from backup_utils.backup_file import BackupFile
+
+COMPRESSIONS = ['none', 'gz:1', 'gz:6', 'gz', 'bz2:1', 'bz2', 'xz:0', 'xz']
+LOG_LEVELS = ['INFO', 'DEBUG', 'WARNING', 'ERROR']
+MB = 1024 * 1024
+
+
+def write_random_data(path: str, size: int):
+    """
+    Writes incompressible data, like already compressed media
+    """
+    with open(path, 'wb') as data_file:
+        data_file.write(os.urandom(size))
+
+
+def write_log_data(path: str, size: int):
+    """
+    Writes text with the shape of application logs
+    """
+    rng = random.Random(0)
+    written = 0
+    with open(path, 'w') as data_file:
+        while written < size:
+            line = "2020-10-%02d 12:%02d:%02d %s request %d served in %d ms\n" % (
+                rng.randint(1, 30), rng.randint(0, 59), rng.randint(0, 59),
+                rng.choice(LOG_LEVELS), rng.randint(0, 100000), rng.randint(0, 500))
+            data_file.write(line)
+            written += len(line)
+
+
+def write_sparse_data(path: str, size: int):
+    """
+    Writes mostly zeros with some random blocks, like database dumps or VM images
+    """
+    with open(path, 'wb') as data_file:
+        for i in range(size // 4096):
+            data_file.write(os.urandom(4096) if i % 10 == 0 else bytes(4096))
+
+
+DATASETS = {'random': write_random_data,
+            'logs': write_log_data,
+            'sparse': write_sparse_data}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks backup file compressions')
+    parser.add_argument('--mb', type=int, default=64, help='the size of every dataset in MB')
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        print("%-8s %-8s %12s %10s" % ("dataset", "codec", "MB/s", "ratio"))
+        for dataset, writer in DATASETS.items():
+            src_path = os.path.join(work_dir, dataset)
+            os.mkdir(src_path)
+            writer(os.path.join(src_path, 'data'), args.mb * MB)
+            for compression in COMPRESSIONS:
+                dst_path = os.path.join(work_dir, 'backup')
+                start = time.perf_counter()
+                BackupFile.create_from_path(src_path, dst_path, compression=compression)
+                elapsed = time.perf_counter() - start
+                ratio = args.mb * MB / os.path.getsize(dst_path)
+                print("%-8s %-8s %12.2f %10.2f" % (dataset, compression, args.mb / elapsed, ratio))
+                os.remove(dst_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
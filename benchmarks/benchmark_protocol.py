@@ -0,0 +1,76 @@
+"""
+Compares the control round trips of the BlockingSocketTransferer protocol versions over loopback
+
+Every round trip is a query_backups like command answered with a JSON list of finished backups.
+
+Usage: PYTHONPATH=backup_utils_package python benchmarks/benchmark_protocol.py [--round-trips 2000]
+"""
+import argparse
+import json
+import socket
+import time
+from multiprocessing import Process
+
+from backup_utils.blocking_socket_transferer import BlockingSocketTransferer, PROTOCOL_V1, PROTOCOL_V2
+
+QUERY = json.dumps({"command": "query_backups", "args": {"name": "node", "path": "/data"}})
+BACKUPS_PER_REPLY = [1, 100, 10000]
+
+
+def make_reply(backups: int) -> str:
+    return json.dumps({"message": "OK",
+                       "data": [{"timestamp": "2020-10-10 12:00:%02d" % (i % 60),
+                                 "kb_size": i, "result_path": "/backups/backup_%d_node_data" % i}
+                                for i in range(backups)]})
+
+
+def replier(server_socket: socket.socket, round_trips: int, reply: str, protocol_version: int):
+    client_sock, _ = server_socket.accept()
+    transferer = BlockingSocketTransferer(client_sock, protocol_version=protocol_version)
+    for _ in range(round_trips):
+        transferer.receive_plain_text()
+        transferer.send_plain_text(reply)
+    transferer.close()
+
+
+def measure(round_trips: int, reply: str, protocol_version: int) -> float:
+    """
+    Makes the round trips over loopback
+
+    :return: the elapsed seconds
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(('127.0.0.1', 0))
+    server_socket.listen(1)
+    p = Process(target=replier, args=(server_socket, round_trips, reply, protocol_version))
+    p.start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(server_socket.getsockname())
+    transferer = BlockingSocketTransferer(sock, protocol_version=protocol_version)
+    start = time.perf_counter()
+    for _ in range(round_trips):
+        transferer.send_plain_text(QUERY)
+        transferer.receive_plain_text()
+    elapsed = time.perf_counter() - start
+    transferer.close()
+    p.join()
+    server_socket.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks control round trips over loopback')
+    parser.add_argument('--round-trips', type=int, default=2000, help='the round trips with the smallest reply')
+    args = parser.parse_args()
+    print("%-10s %10s %12s %14s" % ("protocol", "backups", "reply KB", "us/round trip"))
+    for backups in BACKUPS_PER_REPLY:
+        reply = make_reply(backups)
+        round_trips = max(args.round_trips // backups, 10)
+        for protocol_version in [PROTOCOL_V1, PROTOCOL_V2]:
+            elapsed = measure(round_trips, reply, protocol_version)
+            print("%-10s %10d %12d %14.1f" % ("v%d" % protocol_version, backups, len(reply) // 1024,
+                                                elapsed / round_trips * 1000000))
+
+
+if __name__ == '__main__':
+    main()
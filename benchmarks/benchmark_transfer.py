@@ -0,0 +1,82 @@
+"""
+Compares the throughput of the file transfer modes of BlockingSocketTransferer over loopback
+
+Usage: PYTHONPATH=backup_utils_package python benchmarks/benchmark_transfer.py [--mb 1024]
+"""
+import argparse
+import os
+import socket
+import tempfile
+import time
+from multiprocessing import Process
+
+from backup_utils.blocking_socket_transferer import BlockingSocketTransferer
+
+MB = 1024 * 1024
+KB = 1024
+TRANSFER_MODES = [('copy', 4 * KB, False),
+                  ('copy', 256 * KB, False),
+                  ('zero-copy', 64 * KB, True),
+                  ('zero-copy', 1 * MB, True),
+                  ('zero-copy', 4 * MB, True)]
+
+
+class NullFile:
+    """
+    Discards everything written, so the benchmark measures only the transfer
+    """
+
+    def write(self, data) -> int:
+        return len(data)
+
+
+def file_sender(server_socket: socket.socket, file_path: str, file_chunk_size: int, zero_copy: bool):
+    client_sock, _ = server_socket.accept()
+    transferer = BlockingSocketTransferer(client_sock, file_chunk_size, zero_copy)
+    transferer.send_file(file_path)
+    transferer.close()
+
+
+def measure(file_path: str, file_chunk_size: int, zero_copy: bool) -> float:
+    """
+    Transfers the file over loopback
+
+    :return: the elapsed seconds
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(('127.0.0.1', 0))
+    server_socket.listen(1)
+    p = Process(target=file_sender, args=(server_socket, file_path, file_chunk_size, zero_copy))
+    p.start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(server_socket.getsockname())
+    transferer = BlockingSocketTransferer(sock, file_chunk_size, zero_copy)
+    start = time.perf_counter()
+    transferer.receive_file_data(NullFile())
+    elapsed = time.perf_counter() - start
+    transferer.close()
+    p.join()
+    server_socket.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks file transfers over loopback')
+    parser.add_argument('--mb', type=int, default=1024, help='the size of the transferred file in MB')
+    parser.add_argument('--runs', type=int, default=3, help='the runs of every mode, the best one is shown')
+    args = parser.parse_args()
+    file_descriptor, file_path = tempfile.mkstemp()
+    try:
+        with os.fdopen(file_descriptor, 'wb') as data_file:
+            for _ in range(args.mb):
+                data_file.write(os.urandom(MB))
+        print("%-10s %10s %10s" % ("mode", "chunk KB", "GB/s"))
+        for mode, file_chunk_size, zero_copy in TRANSFER_MODES:
+            elapsed = min(measure(file_path, file_chunk_size, zero_copy) for _ in range(args.runs))
+            print("%-10s %10d %10.2f" % (mode, file_chunk_size // KB, args.mb / 1024 / elapsed))
+    finally:
+        os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main()
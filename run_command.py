@@ -2,7 +2,7 @@ import argparse
 import json
 import socket
 
-from backup_utils.blocking_socket_transferer import BlockingSocketTransferer
+from backup_utils.blocking_socket_transferer import BlockingSocketTransferer, LATEST_PROTOCOL
 
 parser = argparse.ArgumentParser(description='Sends a command to backup server')
 parser.add_argument('--port', required=True, type=int,
@@ -22,7 +22,7 @@ dict_arguments = json.loads(args.args)
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 sock.connect((address, port))
-socket_transferer = BlockingSocketTransferer(sock)
+socket_transferer = BlockingSocketTransferer(sock, protocol_version=LATEST_PROTOCOL)
 socket_transferer.send_plain_text(json.dumps({"command": command,
                                               "args": dict_arguments}))
 msg = socket_transferer.receive_plain_text()
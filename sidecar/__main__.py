@@ -7,5 +7,14 @@ logging.config.fileConfig('log.conf', disable_existing_loggers=True)
 
 port = int(os.getenv('PORT'))
 listen_backlog = int(os.getenv('MAXIMUM_CONCURRENT_BACKUPS'))
+compression_workers = int(os.getenv('COMPRESSION_WORKERS', 1))
+manifest_path = os.getenv('MANIFEST_PATH', '/tmp/manifests')
+digest_cache_path = os.getenv('DIGEST_CACHE_PATH', '/tmp/digest_cache')
+max_digest_cache_bytes = int(os.getenv('DIGEST_CACHE_MAX_MB', 64)) * 1024 * 1024
+stream_backups = os.getenv('STREAM_BACKUPS', '0') == '1'
+transfer_path = os.getenv('TRANSFER_PATH', '/tmp/transfers')
+transfer_ttl = int(os.getenv('TRANSFER_TTL_SECONDS', 600))
 
-SidecarProcess(port, listen_backlog)()
+SidecarProcess(port, listen_backlog, compression_workers, manifest_path,
+               digest_cache_path, max_digest_cache_bytes, stream_backups,
+               transfer_path, transfer_ttl)()
@@ -0,0 +1,85 @@
+import base64
+import os
+from typing import Optional
+
+from backup_utils.file_manifest import FileManifest
+
+CACHE_FILE_TEMPLATE = '%s/%s'
+DEFAULT_MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class DigestCache:
+    """
+    Persistent cache of the content digests of the files of the backed up paths
+
+    For every backed up path it keeps the last manifest, so a file whose
+    (path, size, mtime_ns, inode) did not change reuses its digest without being read.
+    The cache is bounded by size, the least recently used paths are evicted first.
+    """
+
+    def __init__(self, cache_path: str, max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        """
+        Initializes the digest cache
+
+        :param cache_path: the directory where to save the cache
+        :param max_cache_bytes: the maximum size of the cache in bytes
+        """
+        self.cache_path = cache_path
+        self.max_cache_bytes = max_cache_bytes
+        os.makedirs(cache_path, exist_ok=True)
+
+    def _cache_file(self, path: str) -> str:
+        return CACHE_FILE_TEMPLATE % (self.cache_path,
+                                      base64.b64encode(bytes(path, 'utf-8'), b'-_').decode('ascii'))
+
+    def scan(self, path: str) -> FileManifest:
+        """
+        Scans the metadata of a path using the cached digests of the unchanged files
+
+        :param path: the path to scan
+        :return: the manifest, files not in the cache have no digest
+        """
+        cache_file = self._cache_file(path)
+        cached_manifest = None
+        if os.path.isfile(cache_file):
+            try:
+                cached_manifest = FileManifest.load(cache_file)
+                os.utime(cache_file)
+            except (OSError, ValueError):
+                cached_manifest = None
+        return FileManifest.scan_metadata(path, cached_manifest)
+
+    def save(self, path: str, manifest: FileManifest):
+        """
+        Saves the manifest of a path, evicting the least recently used paths if the cache is full
+
+        :param path: the path
+        :param manifest: the manifest with the digests
+        """
+        cache_file = self._cache_file(path)
+        manifest.save(cache_file + ".tmp")
+        os.replace(cache_file + ".tmp", cache_file)
+        self._evict(keep=cache_file)
+
+    def _evict(self, keep: Optional[str] = None):
+        cache_files = []
+        for file_name in os.listdir(self.cache_path):
+            if file_name.endswith(".tmp"):
+                continue
+            try:
+                file_stat = os.stat(os.path.join(self.cache_path, file_name))
+            except FileNotFoundError:
+                continue
+            cache_files.append((file_stat.st_mtime, file_stat.st_size, os.path.join(self.cache_path, file_name)))
+        cache_files.sort()
+        total_size = sum(size for _, size, _ in cache_files)
+        for _, size, cache_file in cache_files:
+            if total_size <= self.max_cache_bytes:
+                break
+            if cache_file == keep:
+                continue
+            try:
+                os.remove(cache_file)
+            except FileNotFoundError:
+                pass
+            total_size -= size
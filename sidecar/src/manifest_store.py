@@ -0,0 +1,61 @@
+import base64
+import os
+from typing import Optional
+
+from backup_utils.file_manifest import FileManifest
+
+MANIFEST_FILE_TEMPLATE = '%s/%s.%s'
+MAX_MANIFESTS_PER_PATH = 3
+
+
+class ManifestStore:
+    """
+    Stores the manifests of the incremental backups made by the sidecar
+
+    Manifests are saved by path and by the checksum reported for them to the server,
+    so the server asking with its last checksum selects the base of the next backup.
+    Only the newest MAX_MANIFESTS_PER_PATH manifests of each path are kept.
+    """
+
+    def __init__(self, store_path: str):
+        """
+        Initializes the manifest store
+
+        :param store_path: the directory where to save the manifests
+        """
+        self.store_path = store_path
+        os.makedirs(store_path, exist_ok=True)
+
+    @staticmethod
+    def _path_prefix(path: str) -> str:
+        return base64.b64encode(bytes(path, 'utf-8'), b'-_').decode('ascii')
+
+    def load(self, path: str, checksum: str) -> Optional[FileManifest]:
+        """
+        Loads the manifest of a backup
+
+        :param path: the path of the backup
+        :param checksum: the checksum reported for the backup
+        :return: the manifest or None if it is not stored
+        """
+        manifest_path = MANIFEST_FILE_TEMPLATE % (self.store_path, self._path_prefix(path), checksum)
+        if not checksum or not os.path.isfile(manifest_path):
+            return None
+        return FileManifest.load(manifest_path)
+
+    def save(self, path: str, manifest: FileManifest):
+        """
+        Saves the manifest of a backup, removing the oldest ones of the path
+
+        :param path: the path of the backup
+        :param manifest: the manifest
+        """
+        prefix = self._path_prefix(path)
+        manifest_path = MANIFEST_FILE_TEMPLATE % (self.store_path, prefix, manifest.get_hash())
+        manifest.save(manifest_path + ".tmp")
+        os.replace(manifest_path + ".tmp", manifest_path)
+        path_manifests = [os.path.join(self.store_path, f) for f in os.listdir(self.store_path)
+                          if f.startswith(prefix + ".") and not f.endswith(".tmp")]
+        path_manifests.sort(key=os.path.getmtime, reverse=True)
+        for old_manifest in path_manifests[MAX_MANIFESTS_PER_PATH:]:
+            os.remove(old_manifest)
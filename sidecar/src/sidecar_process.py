@@ -1,22 +1,45 @@
 import json
 import logging
+import os
 import socket
 from multiprocessing import Process
+from typing import List, Optional
 
-from backup_utils.backup_file import BackupFile
-from backup_utils.blocking_socket_transferer import BlockingSocketTransferer
+from backup_utils.backup_file import BackupFile, DEFAULT_COMPRESSION
+from backup_utils.blocking_socket_transferer import BlockingSocketTransferer, PROTOCOL_V1, PROTOCOL_V2, \
+    LATEST_PROTOCOL, SocketClosed
+from .digest_cache import DigestCache, DEFAULT_MAX_CACHE_BYTES
+from .manifest_store import ManifestStore
+from .transfer_store import TransferStore, DEFAULT_TRANSFER_TTL
 
 TMP_BACKUP_PATH = "/tmp/%d"
+DEFAULT_MANIFEST_PATH = "/tmp/manifests"
+DEFAULT_DIGEST_CACHE_PATH = "/tmp/digest_cache"
+DEFAULT_TRANSFER_PATH = "/tmp/transfers"
+RESUMABLE_DIFF_PREFIX = "DIFF:"
+RANGES_PREFIX = "RANGES:"
+NEXT_MESSAGE = "NEXT"
 DEFAULT_SOCKET_BUFFER_SIZE = 4096
 
 
 class SidecarProcess:
     logger = logging.getLogger(__module__)
 
-    def __init__(self, port, listen_backlog):
+    def __init__(self, port, listen_backlog, compression_workers: int = 1,
+                 manifest_path: str = DEFAULT_MANIFEST_PATH,
+                 digest_cache_path: str = DEFAULT_DIGEST_CACHE_PATH,
+                 max_digest_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+                 stream_backups: bool = False,
+                 transfer_path: str = DEFAULT_TRANSFER_PATH,
+                 transfer_ttl: int = DEFAULT_TRANSFER_TTL):
         self.backup_no = 0
         self.port = port
         self.listen_backlog = listen_backlog
+        self.compression_workers = compression_workers
+        self.manifest_store = ManifestStore(manifest_path)
+        self.digest_cache = DigestCache(digest_cache_path, max_digest_cache_bytes)
+        self.stream_backups = stream_backups
+        self.transfer_store = TransferStore(transfer_path, transfer_ttl)
         self.process_list = []
 
     def __call__(self):
@@ -25,7 +48,12 @@ class SidecarProcess:
         self._server_socket.listen(self.listen_backlog)
         while True:
             client_sock = self.__accept_new_connection()
-            p = Process(target=self.__handle_client_connection, args=(client_sock, self.backup_no))
+            p = Process(target=self.__handle_client_connection, args=(client_sock, self.backup_no,
+                                                                         self.compression_workers,
+                                                                         self.manifest_store,
+                                                                         self.digest_cache,
+                                                                         self.stream_backups,
+                                                                         self.transfer_store))
             p.start()
             client_sock.close()
             self.backup_no += 1
@@ -33,48 +61,246 @@ class SidecarProcess:
             self.process_list = [p for p in self.process_list if p.is_alive()] + [p]
 
     @staticmethod
-    def __handle_client_connection(client_sock, backup_no: int):
+    def _make_backup_file(path: str, dst_path, previous_checksum: str, compression: str,
+                          compression_workers: int, incremental: bool,
+                          manifest_store: ManifestStore, digest_cache: DigestCache, cached_manifest):
+        """
+        Makes the backup file of a path and saves its manifest
+
+        :return: a tuple (backup file, checksum of the data, checksum of the base backup)
+        """
+        base_checksum = ""
+        if incremental:
+            previous_manifest = manifest_store.load(path, previous_checksum)
+            backup_file, manifest = BackupFile.create_incremental(path, dst_path,
+                                                                  previous_manifest,
+                                                                  compression=compression,
+                                                                  compression_workers=compression_workers)
+            manifest_store.save(path, manifest)
+            data_checksum = manifest.get_hash()
+            if previous_manifest:
+                base_checksum = previous_checksum
+        else:
+            backup_file = BackupFile.create_from_path(path, dst_path,
+                                                      compression=compression,
+                                                      compression_workers=compression_workers)
+            manifest = cached_manifest
+            manifest.fill_digests(backup_file.file_digests)
+            data_checksum = backup_file.get_hash()
+        digest_cache.save(path, manifest)
+        return backup_file, data_checksum, base_checksum
+
+    @staticmethod
+    def __handle_client_connection(client_sock, backup_no: int, compression_workers: int,
+                                   manifest_store: ManifestStore, digest_cache: DigestCache,
+                                   stream_backups: bool, transfer_store: TransferStore):
         """
         Read message from a specific client socket and closes the socket
 
         If a problem arises in the communication with the client, the
         client socket will also be closed
+
+        Before making the backup file the path is scanned with the digest cache, if
+        no file changed the checksum is calculated without reading them and a SAME
+        is answered without making the backup file.
+
+        If the server asks for an incremental backup, the backup file only has what
+        changed since the backup with the previous checksum, if its manifest is stored.
+        After the backup file checksum it sends the checksum of all the data and the
+        checksum of the backup used as base, empty if the backup is a full one.
+
+        The request is always framed with the protocol v1, if it has a protocol field
+        the answers use the newest protocol both sides support.
+
+        If stream_backups is set and the server speaks the protocol v2, the backup file
+        is sent in chunks while it is made instead of being written to disk first, and the
+        checksums follow it as a trailer. As DIFF is answered before knowing the checksum of
+        the data, the server must compare it with the previous one to detect a SAME.
+
+        If the server asks for a resumable transfer, the backup file is kept in the transfer
+        store and DIFF is answered with the id of the transfer. If the connection is lost the
+        server can ask for the rest of the file with that id while the transfer is stored.
+        Streamed backups are not resumable.
+
+        If the server asks for a resumable transfer with more than one stream, RANGES is answered
+        with the id of the transfer and the size of the backup file instead of sending it, and the
+        checksums follow. The server downloads ranges of the file over other connections asking
+        for them with the id, and confirms the checksums once it has the whole file. As the ranges
+        need the backup file on disk, these requests are never streamed.
+
+        If the request has keep_alive set, once it is handled NEXT_MESSAGE is sent
+        and another request is read from the same connection.
         """
         socket_transferer = BlockingSocketTransferer(client_sock)
+        while True:
+            try:
+                msg = socket_transferer.receive_plain_text()
+                msg = json.loads(msg)
+                socket_transferer.protocol_version = min(msg.get('protocol', PROTOCOL_V1), LATEST_PROTOCOL)
+            except (OSError, TimeoutError, SocketClosed) as e:
+                SidecarProcess.logger.exception("Error while reading socket %s: %s" % (client_sock, e))
+                socket_transferer.abort()
+                return
+            if 'resume' in msg:
+                handled = SidecarProcess._resume_transfer(socket_transferer, transfer_store,
+                                                          msg['resume'], msg.get('offset', 0))
+            elif 'range' in msg:
+                handled = SidecarProcess._send_range(socket_transferer, transfer_store,
+                                                     msg['range'], msg['offset'], msg['length'])
+            else:
+                handled = SidecarProcess._handle_backup_request(socket_transferer, msg, backup_no,
+                                                                compression_workers, manifest_store,
+                                                                digest_cache, stream_backups, transfer_store)
+            if not handled:
+                socket_transferer.abort()
+                return
+            if not msg.get('keep_alive', False):
+                socket_transferer.close()
+                return
+            try:
+                socket_transferer.send_plain_text(NEXT_MESSAGE)
+            except OSError as e:
+                SidecarProcess.logger.exception("Error while writing socket %s: %s" % (client_sock, e))
+                client_sock.close()
+                return
+
+    @staticmethod
+    def _handle_backup_request(socket_transferer: BlockingSocketTransferer, msg: dict, backup_no: int,
+                               compression_workers: int, manifest_store: ManifestStore,
+                               digest_cache: DigestCache, stream_backups: bool,
+                               transfer_store: TransferStore) -> bool:
+        """
+        Answers a backup request with SAME or with DIFF and the backup file
+
+        :return: whether the request was handled, if not the connection must be aborted
+        """
+        path, previous_checksum = msg['path'], msg['checksum']
+        compression = msg.get('compression', DEFAULT_COMPRESSION)
+        incremental = msg.get('incremental', False)
+        resumable = msg.get('resumable', False) and transfer_store.ttl > 0
+        ranges = resumable and msg.get('streams', 1) > 1
+        SidecarProcess.logger.debug("Previous checksum for path %s is '%s'" % (path, previous_checksum))
+        transfer_id = None
         try:
-            msg = socket_transferer.receive_plain_text()
-            msg = json.loads(msg)
-            path, previous_checksum = msg['path'], msg['checksum']
-            SidecarProcess.logger.debug("Previous checksum for path %s is '%s'" % (path, previous_checksum))
-        except (OSError, TimeoutError) as e:
-            SidecarProcess.logger.exception("Error while reading socket %s: %s" % (client_sock, e))
-            socket_transferer.abort()
-            return
+            cached_manifest = digest_cache.scan(path)
+            if cached_manifest.is_complete() and cached_manifest.get_hash() == previous_checksum and \
+                    (not incremental or manifest_store.load(path, previous_checksum)):
+                SidecarProcess.logger.info("Previous checksum equals to cached digests, skipping backup")
+                socket_transferer.send_plain_text("SAME")
+                return True
+            if stream_backups and socket_transferer.protocol_version >= PROTOCOL_V2 and not ranges:
+                socket_transferer.send_plain_text("DIFF")
+                with socket_transferer.open_file_stream() as file_stream:
+                    backup_file, data_checksum, base_checksum = SidecarProcess._make_backup_file(
+                        path, file_stream, previous_checksum, compression, compression_workers,
+                        incremental, manifest_store, digest_cache, cached_manifest)
+                SidecarProcess.logger.debug("Backup file streamed")
+                trailer = SidecarProcess._backup_trailer(backup_file, incremental, data_checksum, base_checksum)
+            else:
+                if resumable:
+                    transfer_store.expire()
+                    transfer_id, backup_path = transfer_store.new_transfer()
+                else:
+                    backup_path = TMP_BACKUP_PATH % backup_no
+                backup_file, data_checksum, base_checksum = SidecarProcess._make_backup_file(
+                    path, backup_path, previous_checksum, compression, compression_workers,
+                    incremental, manifest_store, digest_cache, cached_manifest)
+                if data_checksum == previous_checksum:
+                    SidecarProcess.logger.info("Previous checksum equals to actual data, skipping backup")
+                    if transfer_id:
+                        transfer_store.remove(transfer_id)
+                    socket_transferer.send_plain_text("SAME")
+                    return True
+                trailer = SidecarProcess._backup_trailer(backup_file, incremental, data_checksum, base_checksum)
+                if transfer_id:
+                    transfer_store.save_trailer(transfer_id, trailer)
+                if ranges:
+                    socket_transferer.send_plain_text("%s%s:%d" % (RANGES_PREFIX, transfer_id,
+                                                                   os.path.getsize(backup_path)))
+                    SidecarProcess.logger.debug("Backup file of transfer %s offered by ranges" % transfer_id)
+                else:
+                    socket_transferer.send_plain_text(RESUMABLE_DIFF_PREFIX + transfer_id if transfer_id else "DIFF")
+                    socket_transferer.send_file(backup_path)
+                    SidecarProcess.logger.debug("Backup file sent")
+            SidecarProcess._send_trailer(socket_transferer, trailer, transfer_store, transfer_id)
+        except Exception as e:
+            SidecarProcess.logger.exception("Error while making or sending backup file for socket %s: %s" %
+                                            (socket_transferer.socket, e))
+            if transfer_id and transfer_store.load(transfer_id) is None:
+                transfer_store.remove(transfer_id)
+            return False
+        return True
+
+    @staticmethod
+    def _backup_trailer(backup_file: BackupFile, incremental: bool,
+                        data_checksum: str, base_checksum: str) -> List[str]:
+        """
+        Gets the messages sent after a backup file: its checksum and, if it is incremental,
+        the checksum of the data and of the base backup
+        """
+        trailer = [backup_file.get_hash()]
+        if incremental:
+            trailer.append(json.dumps({"checksum": data_checksum, "base_checksum": base_checksum}))
+        return trailer
+
+    @staticmethod
+    def _send_trailer(socket_transferer: BlockingSocketTransferer, trailer: List[str],
+                      transfer_store: TransferStore, transfer_id: Optional[str]):
+        """
+        Sends the messages after a backup file, a resumable transfer is removed once the server confirms them
+        """
+        for message in trailer:
+            socket_transferer.send_plain_text(message)
+        if transfer_id:
+            socket_transferer.receive_ok()
+            transfer_store.remove(transfer_id)
+
+    @staticmethod
+    def _resume_transfer(socket_transferer: BlockingSocketTransferer, transfer_store: TransferStore,
+                         transfer_id: str, offset: int) -> bool:
+        """
+        Sends the rest of the backup file of a stored transfer from offset and its trailer
+
+        :return: whether the transfer was resumed, if not the connection must be aborted
+        """
+        transfer_store.expire()
+        transfer = transfer_store.load(transfer_id)
+        if transfer is None:
+            SidecarProcess.logger.error("Transfer %s to resume not found" % transfer_id)
+            return False
+        backup_path, trailer = transfer
         try:
-            backup_file = BackupFile.create_from_path(path, TMP_BACKUP_PATH % backup_no)
-        except Exception:
-            SidecarProcess.logger.exception("Error while making backup file")
-            socket_transferer.abort()
-            return
-        file_checksum = backup_file.get_hash()
-        if file_checksum == previous_checksum:
-            SidecarProcess.logger.info("Previous checksum equals to actual data, skipping backup")
-            socket_transferer.send_plain_text("SAME")
-            socket_transferer.abort()
-            return
-        else:
-            socket_transferer.send_plain_text("DIFF")
+            socket_transferer.send_plain_text(RESUMABLE_DIFF_PREFIX + transfer_id)
+            socket_transferer.send_file(backup_path, offset)
+            SidecarProcess.logger.debug("Backup file of transfer %s resumed from byte %d" % (transfer_id, offset))
+            SidecarProcess._send_trailer(socket_transferer, trailer, transfer_store, transfer_id)
+        except Exception as e:
+            SidecarProcess.logger.exception("Error while resuming transfer %s: %s" % (transfer_id, e))
+            transfer_store.load(transfer_id)
+            return False
+        return True
+
+    @staticmethod
+    def _send_range(socket_transferer: BlockingSocketTransferer, transfer_store: TransferStore,
+                    transfer_id: str, offset: int, length: int) -> bool:
+        """
+        Sends a range of the backup file of a stored transfer, the transfer is kept until its main connection ends
+
+        :return: whether the range was sent, if not the connection must be aborted
+        """
+        transfer = transfer_store.load(transfer_id)
+        if transfer is None:
+            SidecarProcess.logger.error("Transfer %s to send a range not found" % transfer_id)
+            return False
+        backup_path, _ = transfer
         try:
-            socket_transferer.send_file(TMP_BACKUP_PATH % backup_no)
-            SidecarProcess.logger.debug("Backup file sent")
-            socket_transferer.send_plain_text(file_checksum)
+            socket_transferer.send_plain_text(RESUMABLE_DIFF_PREFIX + transfer_id)
+            socket_transferer.send_file(backup_path, offset, length)
+            SidecarProcess.logger.debug("Bytes %d to %d of transfer %s sent" % (offset, offset + length, transfer_id))
         except Exception as e:
-            SidecarProcess.logger.exception("Error while writing socket %s: %s" % (client_sock, e))
-            socket_transferer.abort()
-            return
-        finally:
-            socket_transferer.close()
-        return
+            SidecarProcess.logger.exception("Error while sending a range of transfer %s: %s" % (transfer_id, e))
+            return False
+        return True
 
     def __accept_new_connection(self):
         """
@@ -0,0 +1,96 @@
+import json
+import os
+import re
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+TRANSFER_FILE_TEMPLATE = '%s/%s'
+TRAILER_FILE_TEMPLATE = '%s/%s.trailer'
+TRANSFER_ID_REGEX = re.compile('[0-9a-f]{32}')
+DEFAULT_TRANSFER_TTL = 600
+
+
+class TransferStore:
+    """
+    Keeps the backup files sent to the server for a while, so interrupted transfers can be resumed
+
+    Every transfer has a random id, its backup file and a trailer with the messages
+    sent after the file. Transfers not used for ttl seconds are deleted.
+    """
+
+    def __init__(self, store_path: str, ttl: int = DEFAULT_TRANSFER_TTL):
+        """
+        Initializes the transfer store
+
+        :param store_path: the directory where to save the transfers
+        :param ttl: the seconds a transfer is kept since it was last used, 0 disables resuming
+        """
+        self.store_path = store_path
+        self.ttl = ttl
+        os.makedirs(store_path, exist_ok=True)
+
+    def new_transfer(self) -> Tuple[str, str]:
+        """
+        Creates a new transfer
+
+        :return: a tuple (transfer id, path where to write its backup file)
+        """
+        transfer_id = uuid.uuid4().hex
+        return transfer_id, TRANSFER_FILE_TEMPLATE % (self.store_path, transfer_id)
+
+    def save_trailer(self, transfer_id: str, trailer: List[str]):
+        """
+        Saves the messages sent after the backup file of a transfer
+
+        :param transfer_id: the id of the transfer
+        :param trailer: the messages
+        """
+        with open(TRAILER_FILE_TEMPLATE % (self.store_path, transfer_id), 'w') as trailer_file:
+            json.dump(trailer, trailer_file)
+
+    def load(self, transfer_id: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        Loads a transfer, extending its ttl
+
+        :param transfer_id: the id of the transfer
+        :return: a tuple (path of the backup file, trailer) or None if the transfer is not stored
+        """
+        if not TRANSFER_ID_REGEX.fullmatch(transfer_id):
+            return None
+        transfer_path = TRANSFER_FILE_TEMPLATE % (self.store_path, transfer_id)
+        trailer_path = TRAILER_FILE_TEMPLATE % (self.store_path, transfer_id)
+        try:
+            with open(trailer_path, 'r') as trailer_file:
+                trailer = json.load(trailer_file)
+            os.utime(transfer_path)
+            os.utime(trailer_path)
+        except (OSError, ValueError):
+            return None
+        return transfer_path, trailer
+
+    def remove(self, transfer_id: str):
+        """
+        Removes a transfer
+
+        :param transfer_id: the id of the transfer
+        """
+        for path in [TRANSFER_FILE_TEMPLATE % (self.store_path, transfer_id),
+                     TRAILER_FILE_TEMPLATE % (self.store_path, transfer_id)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        """
+        Removes the files of the transfers not used for ttl seconds
+        """
+        limit = time.time() - self.ttl
+        for file_name in os.listdir(self.store_path):
+            path = os.path.join(self.store_path, file_name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
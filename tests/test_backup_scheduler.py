@@ -14,17 +14,20 @@ class MockNodeHandler:
     PATH_TO_BACKUP = '/tmp/data_for_backup'
 
     def __init__(self, node_address: str, node_port: int,
-                 node_path: str, write_file_path: str, previous_checksum: str):
+                 node_path: str, write_file_path: str, previous_checksum: str,
+                 compression: str = 'gz', incremental: bool = False):
         self.node_address = node_address
         self.node_port = node_port
         self.node_path = node_path
         self.write_file_path = write_file_path
         self.previous_checksum = previous_checksum
+        self.compression = compression
+        self.incremental = incremental
 
     def __call__(self, *args, **kwargs):
         MockNodeHandler.BARRIER.wait()
         bf = BackupFile.create_from_path(MockNodeHandler.PATH_TO_BACKUP,
-                                         self.write_file_path)
+                                         self.write_file_path, self.compression)
         if bf.get_hash() == self.previous_checksum:
             open(self.write_file_path + ".SAME", "w").close()
         else:
@@ -161,6 +164,33 @@ class TestBackupScheduler(unittest.TestCase):
         self.assertEqual(len(set([d['result_path'] for d in data])), 2)
         self.assertTrue(len(os.listdir('/tmp/backup_scheduler_path')) >= 2)
 
+    def test_add_task_with_compression(self):
+        self.client_listener_send.send(('add_node', {'name': 'prueba',
+                                                     'address': '127.0.0.1',
+                                                     'port': 8080}))
+        message, data = self.client_listener_recv.recv()
+        self.assertEqual(message, "OK")
+        self.client_listener_send.send(('add_task', {'name': 'prueba',
+                                                     'path': '/path',
+                                                     'frequency': 1,
+                                                     'compression': 'zip'}))
+        message, data = self.client_listener_recv.recv()
+        self.assertNotEqual(message, "OK")
+        self.client_listener_send.send(('add_task', {'name': 'prueba',
+                                                     'path': '/path',
+                                                     'frequency': 1,
+                                                     'compression': 'xz:1'}))
+        message, data = self.client_listener_recv.recv()
+        self.assertEqual(message, "OK")
+        self.barrier.wait()
+        data = []
+        while not data:
+            self.client_listener_send.send(('query_backups', {'name': 'prueba',
+                                                              'path': '/path'}))
+            message, data = self.client_listener_recv.recv()
+            self.assertEqual(message, "OK")
+        self.assertEqual(data[0]['compression'], 'xz:1')
+
     def test_simple_add_task_and_delete_task(self):
         self.client_listener_send.send(('add_node', {'name': 'prueba',
                                                      'address': '127.0.0.1',
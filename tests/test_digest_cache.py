@@ -0,0 +1,39 @@
+import os
+import shutil
+import unittest
+
+from sidecar.src.digest_cache import DigestCache
+
+
+class TestDigestCache(unittest.TestCase):
+    def setUp(self) -> None:
+        shutil.rmtree('/tmp/digest_cache_test', ignore_errors=True)
+        shutil.rmtree('/tmp/digest_cache_data', ignore_errors=True)
+        os.mkdir('/tmp/digest_cache_data')
+        with open('/tmp/digest_cache_data/file', 'w') as data_file:
+            data_file.write("asd")
+
+    def tearDown(self) -> None:
+        shutil.rmtree('/tmp/digest_cache_test', ignore_errors=True)
+        shutil.rmtree('/tmp/digest_cache_data', ignore_errors=True)
+
+    def test_unchanged_files_keep_digest(self):
+        cache = DigestCache('/tmp/digest_cache_test')
+        manifest = cache.scan('/tmp/digest_cache_data')
+        self.assertFalse(manifest.is_complete())
+        manifest.set_digest('/tmp/digest_cache_data/file', 'digest')
+        cache.save('/tmp/digest_cache_data', manifest)
+        cache = DigestCache('/tmp/digest_cache_test')
+        manifest = cache.scan('/tmp/digest_cache_data')
+        self.assertTrue(manifest.is_complete())
+        with open('/tmp/digest_cache_data/file', 'w') as data_file:
+            data_file.write("asdf")
+        self.assertFalse(cache.scan('/tmp/digest_cache_data').is_complete())
+
+    def test_eviction(self):
+        cache = DigestCache('/tmp/digest_cache_test', max_cache_bytes=1)
+        for i in range(5):
+            os.mkdir('/tmp/digest_cache_data/%d' % i)
+            cache.save('/tmp/digest_cache_data/%d' % i, cache.scan('/tmp/digest_cache_data/%d' % i))
+        self.assertEqual(len(os.listdir('/tmp/digest_cache_test')), 1)
+        self.assertTrue(cache.scan('/tmp/digest_cache_data/4').entries)
@@ -42,6 +42,14 @@ class TestDiskDatabase(unittest.TestCase):
         self.database = DiskDatabase('/tmp/disk_db_concus')
         self.assertEqual(self.database.get_node_address('node'), ('%d' % 249, 249))
 
+    def test_get_node_streams(self):
+        self.assertEqual(self.database.get_node_streams('node'), 1)
+        self.database.register_node('node', 'address', 1111)
+        self.assertEqual(self.database.get_node_streams('node'), 1)
+        self.database.register_node('node', 'address', 1111, streams=4)
+        self.database = DiskDatabase('/tmp/disk_db_concus')
+        self.assertEqual(self.database.get_node_streams('node'), 4)
+
     def test_get_node_address_error(self):
         self.database.register_node('name', 'address', 1111)
         with self.assertRaises(UnexistentNodeError):
@@ -66,6 +74,28 @@ class TestDiskDatabase(unittest.TestCase):
         self.database.add_scheduled_task('node', '/home', 5)
         self.assertEqual(self.database.get_tasks_for_node('node'), [('/home', 5)])
 
+    def test_add_scheduled_task_compression(self):
+        self.database.register_node('node', 'address', 1111)
+        self.database.add_scheduled_task('node', '/home', 3, 'xz:1')
+        self.database.add_scheduled_task('node', '/etc', 3)
+        self.database = DiskDatabase('/tmp/disk_db_concus')
+        self.assertEqual(self.database.get_tasks_for_node('node'), [('/home', 3), ('/etc', 3)])
+        self.assertEqual(self.database.get_task_compression('node', '/home'), 'xz:1')
+        self.assertEqual(self.database.get_task_compression('node', '/etc'), 'gz')
+        self.database.add_scheduled_task('node', '/home', 3, 'none')
+        self.assertEqual(self.database.get_task_compression('node', '/home'), 'none')
+        self.database.delete_scheduled_task('node', '/home')
+        self.assertEqual(self.database.get_task_compression('node', '/home'), 'gz')
+
+    def test_add_scheduled_task_incremental(self):
+        self.database.register_node('node', 'address', 1111)
+        self.database.add_scheduled_task('node', '/home', 3, incremental=True)
+        self.database.add_scheduled_task('node', '/etc', 3)
+        self.database = DiskDatabase('/tmp/disk_db_concus')
+        self.assertTrue(self.database.is_task_incremental('node', '/home'))
+        self.assertFalse(self.database.is_task_incremental('node', '/etc'))
+        self.assertFalse(self.database.is_task_incremental('node2', '/etc'))
+
     def test_add_scheduled_tasks_same_node(self):
         self.database.register_node('node', 'address', 1111)
         self.database.add_scheduled_task('node', '/home', 3)
@@ -118,6 +148,22 @@ class TestDiskDatabase(unittest.TestCase):
         self.database.register_finished_task('node', '/home', ft1)
         self.assertEqual(self.database.get_node_finished_tasks('node', '/tmp'), [])
 
+    def test_backup_chain(self):
+        self.database.register_node('node', 'address', 1111)
+        self.database.add_scheduled_task('node', '/home', 4, incremental=True)
+        ft1 = FinishedTask('/tmp/backup1', 223.43, datetime.now(), checksum="1")
+        ft2 = FinishedTask('/tmp/backup2', 2.43, datetime.now(), checksum="2",
+                           base_result_path='/tmp/backup1')
+        ft2_same = ft2._replace(timestamp=datetime.now())
+        ft3 = FinishedTask('/tmp/backup3', 2.43, datetime.now(), checksum="3",
+                           base_result_path='/tmp/backup2')
+        for ft in [ft1, ft2, ft2_same, ft3]:
+            self.database.register_finished_task('node', '/home', ft)
+        self.database = DiskDatabase('/tmp/disk_db_concus')
+        self.assertEqual(self.database.get_backup_chain('node', '/home', ft3), [ft1, ft2, ft3])
+        self.assertEqual(self.database.get_backup_chain('node', '/home', ft2_same), [ft1, ft2_same])
+        self.assertEqual(self.database.get_backup_chain('node', '/home', ft1), [ft1])
+
     def test_add_finished_task_errors(self):
         self.database.register_node('node', 'address', 1111)
         self.database.add_scheduled_task('node', '/home', 4)
@@ -8,3 +8,9 @@ class TestFinishedTasks(unittest.TestCase):
     def testToDictFromDict(self):
         ft = FinishedTask('/home', 0, datetime.now(), checksum="")
         self.assertEqual(ft, FinishedTask.from_dict(ft.to_dict()))
+
+    def testFromDictWithoutCompression(self):
+        ft = FinishedTask('/home', 0, datetime.now(), checksum="", compression="xz")
+        data = ft.to_dict()
+        del data['compression']
+        self.assertEqual(FinishedTask.from_dict(data).compression, "gz")
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import os
@@ -6,14 +7,52 @@ import shutil
 import socket
 import unittest
 from multiprocessing import Process
+from threading import Thread
 from time import sleep
 
-from backup_server.src.backup_scheduler.node_handler_process import NodeHandlerProcess
+from backup_server.src.backup_scheduler.async_download_engine import AsyncDownloadEngine
+from backup_server.src.backup_scheduler.async_node_handler import AsyncNodeHandler
+from backup_server.src.backup_scheduler.node_handler_process import NodeHandlerProcess, NodeBatchHandlerProcess
 from backup_utils.backup_file import BackupFile
 from backup_utils.blocking_socket_transferer import BlockingSocketTransferer
 from sidecar.src.sidecar_process import SidecarProcess
 
 
+def pipe_data(src, dst, limit=None):
+    sent = 0
+    try:
+        while limit is None or sent < limit:
+            data = src.recv(65536)
+            if not data:
+                break
+            if limit is not None:
+                data = data[:limit - sent]
+            dst.sendall(data)
+            sent += len(data)
+    except OSError:
+        pass
+    for sock in [src, dst]:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+
+def cutting_proxy(port, target_port, cut_after_bytes):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('', port))
+    server_socket.listen(5)
+    limit = cut_after_bytes
+    while True:
+        client_sock, _ = server_socket.accept()
+        target_sock = socket.create_connection(('localhost', target_port))
+        Thread(target=pipe_data, args=(client_sock, target_sock)).start()
+        Thread(target=pipe_data, args=(target_sock, client_sock, limit)).start()
+        limit = None
+
+
 class TestSidecar(unittest.TestCase):
     PORT = random.randint(3000, 5000)
 
@@ -51,6 +90,8 @@ class TestSidecar(unittest.TestCase):
         expected_file = BackupFile.create_from_path('/tmp/example', "/tmp/backup_output/out2")
         backup_file = BackupFile("/tmp/backup_output/out")
         self.assertEqual(expected_file.get_hash(), backup_file.get_hash())
+        with open('/tmp/backup_output/out.RESULT') as result_file:
+            self.assertEqual(json.load(result_file)['checksum'], expected_file.get_hash())
 
     def test_backup_same_checksum(self):
         expected_file = BackupFile.create_from_path('/tmp/example',
@@ -63,6 +104,198 @@ class TestSidecar(unittest.TestCase):
         node_handler_process()
         self.assertTrue(os.path.exists('/tmp/backup_output/out.SAME'))
 
+    def test_same_checksum_skips_backup_file(self):
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example',
+                                                  '/tmp/backup_output/out',
+                                                  'dummy_checksum')
+        sleep(5)
+        node_handler_process()
+        checksum = BackupFile("/tmp/backup_output/out").get_hash()
+        if os.path.exists('/tmp/1'):
+            os.remove('/tmp/1')
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example',
+                                                  '/tmp/backup_output/out_same',
+                                                  checksum)
+        node_handler_process()
+        self.assertTrue(os.path.exists('/tmp/backup_output/out_same.SAME'))
+        self.assertFalse(os.path.exists('/tmp/1'))
+
+    def test_incremental_backups(self):
+        shutil.rmtree('/tmp/example_dir', ignore_errors=True)
+        os.mkdir('/tmp/example_dir')
+        with open('/tmp/example_dir/example', 'w') as example_file:
+            example_file.write("asd")
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/incremental1',
+                                                  '', incremental=True)
+        sleep(5)
+        node_handler_process()
+        self.assertTrue(os.path.exists('/tmp/backup_output/incremental1.CORRECT'))
+        with open('/tmp/backup_output/incremental1.RESULT') as result_file:
+            result = json.load(result_file)
+        self.assertEqual(result['base_checksum'], '')
+        with open('/tmp/example_dir/other_example', 'w') as example_file:
+            example_file.write("qwerty")
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/incremental2',
+                                                  result['checksum'], incremental=True)
+        node_handler_process()
+        with open('/tmp/backup_output/incremental2.RESULT') as result_file:
+            second_result = json.load(result_file)
+        self.assertEqual(second_result['base_checksum'], result['checksum'])
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/incremental3',
+                                                  second_result['checksum'], incremental=True)
+        node_handler_process()
+        self.assertTrue(os.path.exists('/tmp/backup_output/incremental3.SAME'))
+        shutil.rmtree('/tmp/example_dir')
+        BackupFile.extract_chain(['/tmp/backup_output/incremental1', '/tmp/backup_output/incremental2'],
+                                 '/tmp/backup_output/restore')
+        with open('/tmp/backup_output/restore/tmp/example_dir/other_example') as example_file:
+            self.assertEqual(example_file.read(), "qwerty")
+
+    def test_streamed_backups(self):
+        self.p.terminate()
+        self.p.join()
+        self.p = Process(target=SidecarProcess(TestSidecar.PORT, 3, stream_backups=True))
+        self.p.start()
+        shutil.rmtree('/tmp/example_dir', ignore_errors=True)
+        os.mkdir('/tmp/example_dir')
+        with open('/tmp/example_dir/example', 'w') as example_file:
+            example_file.write("big dummy text" * 200000)
+        if os.path.exists('/tmp/0'):
+            os.remove('/tmp/0')
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/streamed1',
+                                                  'dummy_checksum')
+        sleep(5)
+        node_handler_process()
+        self.assertTrue(os.path.exists('/tmp/backup_output/streamed1.CORRECT'))
+        self.assertFalse(os.path.exists('/tmp/0'))
+        expected_file = BackupFile.create_from_path('/tmp/example_dir', "/tmp/backup_output/out2")
+        self.assertEqual(BackupFile('/tmp/backup_output/streamed1').get_hash(), expected_file.get_hash())
+        os.utime('/tmp/example_dir/example', (0, 0))
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/streamed2',
+                                                  expected_file.get_hash())
+        node_handler_process()
+        self.assertTrue(os.path.exists('/tmp/backup_output/streamed2.SAME'))
+        self.assertFalse(os.path.exists('/tmp/backup_output/streamed2'))
+        shutil.rmtree('/tmp/example_dir')
+
+    def test_resume_interrupted_transfer(self):
+        shutil.rmtree('/tmp/example_dir', ignore_errors=True)
+        os.mkdir('/tmp/example_dir')
+        with open('/tmp/example_dir/example', 'wb') as example_file:
+            example_file.write(os.urandom(2000000))
+        proxy = Process(target=cutting_proxy, args=(TestSidecar.PORT + 1000, TestSidecar.PORT, 500000))
+        proxy.start()
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT + 1000,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/resumed',
+                                                  'dummy_checksum', resume_wait=0.1)
+        stored_transfers = os.listdir(self.sidecar_process.transfer_store.store_path)
+        sleep(5)
+        with self.assertLogs(NodeHandlerProcess.logger, 'WARNING'):
+            node_handler_process()
+        proxy.terminate()
+        self.assertTrue(os.path.exists('/tmp/backup_output/resumed.CORRECT'))
+        expected_file = BackupFile.create_from_path('/tmp/example_dir', "/tmp/backup_output/out2")
+        self.assertEqual(BackupFile('/tmp/backup_output/resumed').get_hash(), expected_file.get_hash())
+        self.assertEqual(os.listdir(self.sidecar_process.transfer_store.store_path), stored_transfers)
+        shutil.rmtree('/tmp/example_dir')
+
+    def test_parallel_ranges_download(self):
+        shutil.rmtree('/tmp/example_dir', ignore_errors=True)
+        os.mkdir('/tmp/example_dir')
+        with open('/tmp/example_dir/example', 'wb') as example_file:
+            example_file.write(os.urandom(30000000))
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example_dir',
+                                                  '/tmp/backup_output/ranges',
+                                                  'dummy_checksum', compression='none', streams=3)
+        stored_transfers = os.listdir(self.sidecar_process.transfer_store.store_path)
+        sleep(5)
+        with self.assertLogs(NodeHandlerProcess.logger, 'DEBUG') as logs:
+            node_handler_process()
+        self.assertTrue(any("over 3 connections" in line for line in logs.output))
+        self.assertTrue(os.path.exists('/tmp/backup_output/ranges.CORRECT'))
+        expected_file = BackupFile.create_from_path('/tmp/example_dir', "/tmp/backup_output/out2")
+        self.assertEqual(BackupFile('/tmp/backup_output/ranges').get_hash(), expected_file.get_hash())
+        self.assertEqual(os.listdir(self.sidecar_process.transfer_store.store_path), stored_transfers)
+        shutil.rmtree('/tmp/example_dir')
+
+    def test_several_paths_over_one_connection(self):
+        expected_file = BackupFile.create_from_path('/tmp/example', "/tmp/backup_output/out2")
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example',
+                                                  '/tmp/backup_output/batch1',
+                                                  'dummy_checksum')
+        sleep(5)
+        socket_transferer = node_handler_process(keep_alive=True)
+        self.assertIsNotNone(socket_transferer)
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example',
+                                                  '/tmp/backup_output/batch2',
+                                                  expected_file.get_hash())
+        self.assertIs(node_handler_process(socket_transferer=socket_transferer, keep_alive=True),
+                      socket_transferer)
+        node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
+                                                  '/tmp/example',
+                                                  '/tmp/backup_output/batch3',
+                                                  'dummy_checksum')
+        self.assertIsNone(node_handler_process(socket_transferer=socket_transferer))
+        self.assertTrue(os.path.exists('/tmp/backup_output/batch1.CORRECT'))
+        self.assertTrue(os.path.exists('/tmp/backup_output/batch2.SAME'))
+        self.assertTrue(os.path.exists('/tmp/backup_output/batch3.CORRECT'))
+        self.assertEqual(BackupFile('/tmp/backup_output/batch3').get_hash(), expected_file.get_hash())
+
+    def test_batch_handler(self):
+        node_handlers = [NodeHandlerProcess('localhost', TestSidecar.PORT, '/tmp/example',
+                                            '/tmp/backup_output/batch%d' % i, 'dummy_checksum')
+                         for i in range(3)]
+        sleep(5)
+        NodeBatchHandlerProcess(node_handlers)()
+        for i in range(3):
+            self.assertTrue(os.path.exists('/tmp/backup_output/batch%d.CORRECT' % i))
+
+    def test_async_node_handler(self):
+        expected_file = BackupFile.create_from_path('/tmp/example', "/tmp/backup_output/out2")
+        node_handler = AsyncNodeHandler('localhost', TestSidecar.PORT, '/tmp/example',
+                                        '/tmp/backup_output/async1', 'dummy_checksum')
+        sleep(5)
+        asyncio.run(node_handler())
+        self.assertTrue(os.path.exists('/tmp/backup_output/async1.CORRECT'))
+        self.assertFalse(os.path.exists('/tmp/backup_output/async1.WIP'))
+        self.assertEqual(BackupFile('/tmp/backup_output/async1').get_hash(), expected_file.get_hash())
+        node_handler = AsyncNodeHandler('localhost', TestSidecar.PORT, '/tmp/example',
+                                        '/tmp/backup_output/async2', expected_file.get_hash())
+        asyncio.run(node_handler())
+        self.assertTrue(os.path.exists('/tmp/backup_output/async2.SAME'))
+
+    def test_async_download_engine(self):
+        engine = AsyncDownloadEngine(max_concurrent_downloads=2, hash_workers=1)
+        engine.start()
+        sleep(5)
+        jobs = [engine.submit(AsyncNodeHandler('localhost', TestSidecar.PORT, '/tmp/example',
+                                               '/tmp/backup_output/async%d' % i, 'dummy_checksum'))
+                for i in range(3)]
+        for _ in range(100):
+            if not any(job.is_alive() for job in jobs):
+                break
+            sleep(0.1)
+        self.assertFalse(any(job.is_alive() for job in jobs))
+        engine.stop()
+        for i in range(3):
+            self.assertTrue(os.path.exists('/tmp/backup_output/async%d.CORRECT' % i))
+
     def test_node_handler_ends_when_unexistent_path(self):
         node_handler_process = NodeHandlerProcess('localhost', TestSidecar.PORT,
                                                   '/tmp/example2',
@@ -0,0 +1,42 @@
+import os
+import shutil
+import unittest
+
+from sidecar.src.transfer_store import TransferStore
+
+
+class TestTransferStore(unittest.TestCase):
+    def setUp(self) -> None:
+        shutil.rmtree('/tmp/transfer_store_test', ignore_errors=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree('/tmp/transfer_store_test', ignore_errors=True)
+
+    def test_load_saved_transfer(self):
+        store = TransferStore('/tmp/transfer_store_test')
+        transfer_id, transfer_path = store.new_transfer()
+        self.assertIsNone(store.load(transfer_id))
+        with open(transfer_path, 'w') as transfer_file:
+            transfer_file.write("asd")
+        store.save_trailer(transfer_id, ["checksum"])
+        self.assertEqual(store.load(transfer_id), (transfer_path, ["checksum"]))
+        store.remove(transfer_id)
+        self.assertIsNone(store.load(transfer_id))
+        self.assertEqual(os.listdir('/tmp/transfer_store_test'), [])
+
+    def test_invalid_id_not_loaded(self):
+        store = TransferStore('/tmp/transfer_store_test')
+        self.assertIsNone(store.load('../../etc/passwd'))
+
+    def test_expire_old_transfers(self):
+        store = TransferStore('/tmp/transfer_store_test', ttl=60)
+        old_id, old_path = store.new_transfer()
+        new_id, new_path = store.new_transfer()
+        for transfer_id, transfer_path in [(old_id, old_path), (new_id, new_path)]:
+            open(transfer_path, 'w').close()
+            store.save_trailer(transfer_id, [])
+        os.utime(old_path, (0, 0))
+        os.utime(old_path + ".trailer", (0, 0))
+        store.expire()
+        self.assertIsNone(store.load(old_id))
+        self.assertIsNotNone(store.load(new_id))